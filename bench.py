@@ -0,0 +1,231 @@
+#!/usr/bin/pypy
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import textwrap
+import time
+import traceback
+
+from collections import namedtuple
+
+from bj.cache import LRUCache
+from bj.card import COUNTS
+from bj.game import GameStateDist
+from bj.odds import OddsCalculator
+from bj.prob import ProbDist, add_module_opts as add_module_opts__bj_prob
+from bj.rule import RULES
+
+import bj.card
+import bj.rule
+
+
+"""Initial cards for the workloads that are given a fixed deal."""
+CELL = (0, 6, 6)
+
+def standStrategy(gs):
+	return GameStateDist.inject(gs.turnDone())
+
+def benchBind(cards, rule, approx2h):
+	"""Draw 4 cards using plain ProbDist.bind, keeping their total."""
+	d = ProbDist.inject((0, cards))
+	for i in xrange(4):
+		d = d.bind(lambda (total, cards): cards.draw().map(lambda (card, nextcards): (total + card, nextcards)))
+	return len(d.dist)
+
+def benchDeal(cards, rule, approx2h):
+	"""GameStateDist.dealNewRound for 1 player, all cards random."""
+	return len(GameStateDist.initGame(2, cards).dealNewRound().dist)
+
+def benchRound(cards, rule, approx2h):
+	"""GameStateDist.execRound for a fixed deal, player stands."""
+	gsd = GameStateDist.initGame(2, cards).dealNewRound(cards=list(CELL))
+	return len(gsd.execRound([rule.playHouse, standStrategy]).dist)
+
+def benchOdds(cards, rule, approx2h):
+	"""OddsCalculator.calculateOdds for a fixed deal, with cold caches."""
+	OddsCalculator(cards, rule, approx2h=approx2h).calculateOdds(*CELL)
+	return sum(len(c) for c in LRUCache.instances)
+
+def benchTable(cards, rule, approx2h):
+	"""OddsCalculator.printTable, with cold caches."""
+	with open("/dev/null", "w") as fp:
+		OddsCalculator(cards, rule, approx2h=approx2h).printTable(fp)
+	return sum(len(c) for c in LRUCache.instances)
+
+"""Workloads, and the card states that each is run with.
+
+Sizes reported are the number of events in the final distribution, or the
+number of memoised entries for the calculator workloads.
+"""
+WORKLOADS = [
+	("bind", benchBind, COUNTS),
+	("deal", benchDeal, COUNTS),
+	("round", benchRound, COUNTS),
+	("odds", benchOdds, COUNTS),
+	("table", benchTable, ["NullCardState"]),
+]
+
+"""Workloads whose result depends on approx2h; the others are only run once."""
+APPROX2H_WORKLOADS = ["odds", "table"]
+
+
+class Bench(namedtuple('Bench', 'workload count rule approx2h')):
+
+	@property
+	def key(self):
+		return "%s/%s/%s%s" % (self.workload, self.count, self.rule, "/approx2h" if self.approx2h else "")
+
+	def run(self):
+		"""Run this in a new process, so that caches start off cold and the peak
+		memory is just for this workload.
+
+		@return: dict of wall time (s), peak resident memory (KiB) and size.
+		"""
+		queue = multiprocessing.Queue()
+		proc = multiprocessing.Process(target=_benchWorker, args=(self, queue))
+		proc.start()
+		try:
+			ok, result = queue.get()
+		finally:
+			proc.join()
+		if not ok:
+			raise RuntimeError("benchmark %s failed:\n%s" % (self.key, result))
+		return result
+
+def _benchWorker(bench, queue):
+	try:
+		f = dict((name, f) for name, f, counts in WORKLOADS)[bench.workload]
+		rule = getattr(bj.rule, bench.rule)
+		cards = getattr(bj.card, bench.count)(decks=rule.defaultDecks)
+		start = time.time()
+		size = f(cards, rule, bench.approx2h)
+		wall = time.time() - start
+		queue.put((True, {"wall": wall, "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "size": size}))
+	except Exception:
+		queue.put((False, traceback.format_exc()))
+
+def benchmarks(workloads, counts, rules, approx2h):
+	for name, f, wcounts in WORKLOADS:
+		if name not in workloads: continue
+		for count in wcounts:
+			if count not in counts: continue
+			for rule in rules:
+				for a in (approx2h if name in APPROX2H_WORKLOADS else [False]):
+					yield Bench(name, count, rule, a)
+
+def runBenchmarks(benches, repeat=1, fp=sys.stdout):
+	"""Run each benchmark, keeping the fastest of repeat runs.
+
+	@return: dict of Bench.key to results, see Bench.run
+	"""
+	results = {}
+	for bench in benches:
+		runs = [bench.run() for i in xrange(repeat)]
+		results[bench.key] = best = min(runs, key=lambda r: r["wall"])
+		print >>fp, "%-48s %9.3fs %9d KiB %9d" % (bench.key, best["wall"], best["maxrss"], best["size"])
+		fp.flush()
+	return results
+
+def compareResults(results, baseline, threshold, fp=sys.stdout):
+	"""Print the change of each result against the baseline.
+
+	@return: list of keys that got slower by more than threshold
+	"""
+	slower = []
+	for key in sorted(results):
+		if key not in baseline:
+			print >>fp, "%-48s (not in baseline)" % key
+			continue
+		new, old = results[key], baseline[key]
+		ratio = new["wall"] / old["wall"] if old["wall"] else float("inf")
+		flag = ""
+		if ratio > 1 + threshold:
+			flag = " SLOWER"
+			slower.append(key)
+		elif ratio < 1 - threshold:
+			flag = " faster"
+		print >>fp, "%-48s %9.3fs -> %9.3fs (x%.2f) %9d -> %9d KiB%s" % (
+			key, old["wall"], new["wall"], ratio, old["maxrss"], new["maxrss"], flag)
+		if new["size"] != old["size"]:
+			print >>fp, "%-48s size changed: %d -> %d" % ("", old["size"], new["size"])
+	return slower
+
+def main(argv):
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		description=textwrap.dedent("""\
+		Benchmark the probability monad and odds calculator.
+
+		Each benchmark runs in its own process, and its wall time, peak
+		resident memory and result size are recorded.
+
+		Examples:
+
+		  # Run the default benchmarks and save them as a baseline.
+		  $ bench.py --output base.json
+
+		  # After making some changes, compare against that baseline.
+		  $ bench.py --baseline base.json --output new.json
+
+		  # Just the calculator, for TotalCardState.
+		  $ bench.py --workload odds --count TotalCardState
+		"""))
+	parser.add_argument(
+		"--workload", help="Workloads to run. Default: all except table",
+		action="append", choices=[name for name, f, counts in WORKLOADS])
+	parser.add_argument(
+		"--count", help="Card states to run with. Default: all",
+		action="append", choices=COUNTS)
+	parser.add_argument(
+		"--rule", help="Rules to run with. Default: all",
+		action="append", choices=RULES)
+	parser.add_argument(
+		"--approx2h", help="Run calculator workloads with approx2h off, on, "
+		"or both. Default: %(default)s",
+		default="both", choices=["off", "on", "both"])
+	parser.add_argument(
+		"--repeat", help="Run each benchmark this many times and keep the "
+		"fastest. Default: %(default)s",
+		default=1, type=int)
+	parser.add_argument(
+		"--output", help="Write results to this file, as JSON.",
+		default=None)
+	parser.add_argument(
+		"--baseline", help="Compare results against this file, as written by "
+		"--output. Exits with status 1 if anything got slower.",
+		default=None)
+	parser.add_argument(
+		"--threshold", help="Relative change in wall time that counts as "
+		"slower or faster when comparing. Default: %(default)s",
+		default=0.1, type=float)
+	add_module_opts__bj_prob(parser)
+	args = parser.parse_args(argv)
+
+	approx2h = {"off": [False], "on": [True], "both": [False, True]}[args.approx2h]
+	benches = list(benchmarks(
+		args.workload or [name for name, f, counts in WORKLOADS if name != "table"],
+		args.count or COUNTS,
+		args.rule or RULES, approx2h))
+	results = runBenchmarks(benches, args.repeat)
+
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump({
+				"python": "%s %s" % (platform.python_implementation(), platform.python_version()),
+				"argv": argv,
+				"results": results,
+			}, fp, indent=1, sort_keys=True)
+
+	if args.baseline:
+		with open(args.baseline) as fp:
+			baseline = json.load(fp)["results"]
+		print
+		if compareResults(results, baseline, args.threshold):
+			return 1
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
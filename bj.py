@@ -2,16 +2,65 @@
 
 import argparse
 import ast
+import cProfile
 import logging
+import pstats
 import sys
 import textwrap
 
-from bj.card import CardState
-from bj.odds import OddsCalculator
-from bj.prob import add_module_opts as add_module_opts__bj_prob
-from bj.rule import BJ, BJS, BJV
+from fractions import Fraction
+
+from bj.bankroll import kellyFraction, payVariance
+from bj.cache import add_module_opts as add_module_opts__bj_cache
+from bj.card import COUNTS
+from bj.odds import HOUSE_CARDS, TABLE, HardTotal, OddsCalculator, tableRows
+from bj.output import FORMATS, cellName, errorStr, parseHand, sweepFields, sweepRecord, writeCells, writeRecords
+from bj.prob import add_module_opts as add_module_opts__bj_prob, errorOf
+from bj.rule import RULES
+from bj.seats import seatOdds
+from bj.serve import makeServer
+from bj.sim import MonteCarlo
+from bj.stats import add_module_opts as add_module_opts__bj_stats
+from bj.store import OddsStore, defaultPath as defaultStorePath
+from bj.sweep import sweep
 
 import bj.prob
+import bj.rule
+import bj.sim
+import bj.stats
+
+def handArg(s):
+	"""parseHand, for argparse, which only shows the messages of its own errors."""
+	try:
+		return parseHand(s)
+	except ValueError as e:
+		raise argparse.ArgumentTypeError(str(e))
+
+def readHands(fp):
+	"""Read hands one per line, in the same format as on the command line.
+	Blank lines and anything after a # are ignored.
+
+	@raise ValueError: naming the first line that isn't a hand
+	"""
+	hands = []
+	for n, line in enumerate(fp, 1):
+		line = line.split("#", 1)[0].strip()
+		if not line:
+			continue
+		try:
+			hands.append(parseHand(line))
+		except ValueError as e:
+			raise ValueError("%s line %d: %s" % (fp.name, n, e))
+	return hands
+
+def parseRatio(s):
+	"""Parse a payout such as 3:2 or 6:5 (or just 1) into a Fraction."""
+	return Fraction(*map(int, s.split(":", 1)))
+
+def readShoe(fp):
+	"""Read cards in the order dealt, each a digit as in the hands arguments.
+	Whitespace and anything after a # on a line are ignored."""
+	return [int(c) for line in fp for c in line.split("#", 1)[0] if not c.isspace()]
 
 def main(argv):
 	parser = argparse.ArgumentParser(
@@ -33,27 +82,63 @@ def main(argv):
 		  # Exact odds for (10, 6) vs House 8, for standard Blackjack.
 		  $ bj.py --count TotalCardState 086
 
+		  # Strategy table for a Hi-Lo counter, 12 lo cards into a 2-deck game.
+		  $ bj.py --count HiLoCardState --card-decks 2 --card-state [12,0,0]
+
 		See README for more details.
 
-		If calculations take too long, you can try setting `--prob-event-tolerance 1e-6
-		--prob-event-tolerance 1e-2` which shouldn't affect results much. If you only
-		want to get a "general sense" of what a strategy looks like, you can try
-		`--prob-event-tolerance 1e-4 --prob-event-tolerance 1e-1` but a few results
-		will be visibly different from the actual optimal ones.
+		If calculations take too long, you can try setting `--target-error 1e-4`,
+		which prunes unlikely events as much as it can while keeping every odds
+		within 1e-4 of the actual ones, and shows the bound it got. If you only want
+		to get a "general sense" of what a strategy looks like, you can try
+		`--target-error 1e-2` but a few results will be visibly different from the
+		actual optimal ones.
 		"""))
 	parser.add_argument(
 		"hands", help="3-char string describing the initial hand to calculate "
 		"odds for. Each char is a digit for the card with that face value, "
 		"except 0 means 10/J/Q/K and 1 means Ace. Cards are given in the order "
-		"of being dealt, i.e. [player,house,player]. If omitted, we calculate "
+		"of being dealt, i.e. [player,house,player]. The house card and the "
+		"second player card may be X (or the second one left out) for not "
+		"dealt yet. Alternatively, T then a total from 4 to 20 then the house "
+		"card means any hard 2-card hand with that total, e.g. T168 for hard "
+		"16 vs House 8. If omitted, we calculate "
 		"optimal strategies for a representative set of initial hands.",
-		nargs="*", type=lambda s: map(int, list(s.ljust(3,"X")[:3])))
+		nargs="*", type=handArg)
+	parser.add_argument(
+		"--hands-file", help="Read more hands from this file, one per line in "
+		"the same format as the hands arguments; - for stdin.",
+		default=None, type=argparse.FileType("r"))
 	parser.add_argument(
 		"--rule", help="Blackjack rule to play with. Default: %(default)s",
-		default="BJ", choices=["BJ", "BJS", "BJV"])
+		default="BJ", choices=RULES)
+	parser.add_argument(
+		"--stand-on", help="Play a variant of the rule where the house "
+		"stands on this total or more. Default: whatever the rule does.",
+		default=None, type=int)
 	parser.add_argument(
-		"--count", help="Method of card counting. Default: %(default)s",
-		default="NullCardState", choices=[c.__name__ for c in CardState.__subclasses__()])
+		"--soft-17", help="Play a variant of the rule where the house hits or "
+		"stands on a soft 17. Default: whatever the rule does.",
+		default=None, choices=["hit", "stand"])
+	parser.add_argument(
+		"--push-22", help="Play a variant of the rule where a house bust on 22 "
+		"does or does not push. Default: whatever the rule does.",
+		default=None, choices=["yes", "no"])
+	parser.add_argument(
+		"--natural-pays", help="Play a variant of the rule where a player "
+		"natural pays this, e.g. 3:2 or 6:5. Default: whatever the rule does.",
+		default=None, type=parseRatio)
+	parser.add_argument(
+		"--actions", help="Play a variant of the rule where the player can "
+		"only take these actions, e.g. HSD. Default: whatever the rule allows.",
+		default=None)
+	parser.add_argument(
+		"--count", help="Method of card counting: no counting, perfect "
+		"counting, or a counting system, which keeps track of how many cards "
+		"have been drawn from each group of ranks that it counts alike (see "
+		"bj.card.countingSystem). --card-state then gives the number drawn from "
+		"each group, e.g. [lo, 789, hi] for HiLoCardState. Default: %(default)s",
+		default="NullCardState", choices=COUNTS)
 	parser.add_argument(
 		"--card-decks", help="Number of decks in play. Default: whatever the "
 		"default is for the rule being played.",
@@ -62,34 +147,275 @@ def main(argv):
 		"--card-state", help="Initial state of cards, as a python expression "
 		"that is passed to the card-state constructor. Default: %(default)s",
 		default=None, type=ast.literal_eval)
-	parser.add_argument(
+	hitmode = parser.add_mutually_exclusive_group()
+	hitmode.add_argument(
 		"--approx2h", help="Use 2nd-order calculation, which is slightly more "
 		"accurate but much more expensive to calculate. Default: %(default)s",
 		default=False, action="store_true")
+	hitmode.add_argument(
+		"--exact", help="Calculate the exact value of hitting (and doubling), "
+		"assuming optimal hit/stand play afterwards. Intermediate results are "
+		"memoised by (hand, card state, house hand) and shared across the "
+		"whole table. With a counting system this costs a few times as much "
+		"as the default calculation, and more than --approx2h, e.g. 10s "
+		"against 3s and 6s for PartialAJHLCardState from 2 decks. With "
+		"TotalCardState few states are shared between cells, and it takes "
+		"longer: a column of the table from 8 decks takes about 35s, against "
+		"13s for --approx2h, which stops two hits in so plays the house out "
+		"from fewer card states. Default: %(default)s",
+		default=False, action="store_true")
+	parser.add_argument(
+		"--split-hands", help="With --exact, calculate splitting exactly: "
+		"every split hand is played out optimally from the same cards, and "
+		"resplitting is allowed up to this many hands (2 for no resplits). "
+		"Cheap with no card counting, but with card counting each pair is far "
+		"more expensive than any other cell, since each hand is played from "
+		"every card state the ones before it can leave: from 8 decks, 8,8 "
+		"against a 6 takes about 3s with HiLoCardState and 2 hands (20s with "
+		"3), against under a second for the other cells, and about 4 minutes "
+		"with TotalCardState. Default: approximate splitting as twice the "
+		"best odds for holding one of the cards.",
+		default=None, type=int)
+	parser.add_argument(
+		"--target-error", help="Calculate each cell to within this of the "
+		"odds that would be calculated without pruning, pruning as much as "
+		"that allows: --prob-event-tolerance is picked for each cell, starting "
+		"from whatever the cell before it needed and tightening it until the "
+		"bound on the error is within this. The bounds are shown with the "
+		"hands, and in the error field of --format records. Results are not "
+		"stored. Default: off",
+		default=None, type=float, metavar="E")
+	parser.add_argument(
+		"--payoffs", help="Also calculate the distribution of the pay of each "
+		"action, and show the variance and Kelly fraction of the bankroll to "
+		"bet for the best one: with the hands, for each point of --sweep "
+		"(for the whole round), and in the payoffs, variance and kelly fields "
+		"of --format records. With --split-hands, pairs also get the "
+		"covariance of the pays of the split hands. The odds are then the "
+		"expectations of these. Not available with --approx2h or "
+		"--target-error. Default: "
+		"%(default)s",
+		default=False, action="store_true")
+	parser.add_argument(
+		"--hard-totals", help="In the strategy table, show exact odds for each "
+		"hard total, over every 2-card hand that makes it, instead of the "
+		"(J,*) and (2,*) rows that approximate them. Default: %(default)s",
+		default=False, action="store_true")
+	parser.add_argument(
+		"--jobs", help="Number of processes to calculate the strategy table "
+		"with, or with --serve, to answer requests in. Default: %(default)s",
+		default=1, type=int)
+	parser.add_argument(
+		"--format", help="Output format for calculated odds. text is a "
+		"coloured table, or a line per hand. jsonl and csv have a record per "
+		"cell with the odds of each action, the best action, its margin over "
+		"the next best one and the seconds taken, written as soon as the cell "
+		"is calculated (so with --jobs, not necessarily in order). "
+		"Default: %(default)s",
+		default="text", choices=FORMATS)
+	parser.add_argument(
+		"--seats", help="Instead of strategy odds, calculate the expected pay "
+		"of each of this many players at one table, sharing the cards and "
+		"playing hit/stand optimally, as with --exact (the players never "
+		"split). Players act in the order listed. Takes about a second with "
+		"no card counting. With card counting, each seat is played once from "
+		"every card state that the earlier players can leave behind, so it "
+		"takes longer, more so with each seat: e.g. about 4 minutes for 2 "
+		"seats with HiLoCardState. --prob-event-tolerance prunes the "
+		"unlikely states. Default: off",
+		default=0, type=int)
+	parser.add_argument(
+		"--sweep", help="Instead of strategy odds, follow a shoe as it is "
+		"dealt, from this file of cards in the order dealt (digits as in the "
+		"hands arguments; - for stdin), and for the card state at each point "
+		"write the expected pay of a round and the best action for each of the "
+		"hands given. Each point removes a card from the previous one and "
+		"reuses the house play calculated for it that still applies, so later "
+		"points cost less than the first, e.g. 1.5-2.5s rather than 2.7s for "
+		"PartialAJHLCardState from 1 deck.",
+		default=None, type=argparse.FileType("r"), metavar="FILE")
+	parser.add_argument(
+		"--sweep-every", help="With --sweep, only calculate a point every "
+		"this many cards, and after the last one. Default: %(default)s",
+		default=1, type=int, metavar="N")
+	parser.add_argument(
+		"--serve", help="Instead of calculating anything up front, serve "
+		"odds over HTTP as JSON, on [HOST:]PORT or, if it contains a /, on a "
+		"Unix socket at that path. GET /odds?hand=086&hand=T168 for some hands "
+		"or /table[?hard_totals=1] for the strategy table, optionally with "
+		"&state= to calculate from another card state as in --card-state. "
+		"Caches are kept warm across requests, so repeated and related "
+		"queries are answered quickly, and cleared whenever they grow past "
+		"--cache-size. With --jobs N, N requests are calculated at once, "
+		"each process with its own caches. Default: off",
+		default=None, metavar="ADDRESS")
+	parser.add_argument(
+		"--simulate", help="Estimate odds by simulating this many rounds per "
+		"action, instead of calculating them. Requires numpy. Default: off",
+		default=0, type=int, metavar="ROUNDS")
+	parser.add_argument(
+		"--sim-batch", help="Number of rounds to simulate at once. Default: %(default)s",
+		default=100000, type=int)
+	parser.add_argument(
+		"--sim-seed", help="Random seed for --simulate. Default: random",
+		default=None, type=int)
+	parser.add_argument(
+		"--cross-check", help="With --simulate, also calculate the odds and "
+		"show how many standard errors they are from the estimates. Useful to "
+		"check the effect of --prob-event-tolerance. Default: %(default)s",
+		default=False, action="store_true")
+	parser.add_argument(
+		"--store", help="Keep calculated odds in this directory, e.g. %s, so "
+		"that later runs with the same parameters only need to calculate the "
+		"ones that are missing. Nothing is ever removed from it, and results "
+		"from older code are left behind, so clear it out now and then. "
+		"Default: off" % defaultStorePath(),
+		default=None, metavar="DIR")
 	parser.add_argument(
 		"--verbose", help="Show more output. Default: %(default)s",
 		default=False, action="store_true")
+	parser.add_argument(
+		"--profile", help="Run the calculations under cProfile, print the top "
+		"functions by cumulative time to stderr and save the full profile to "
+		"this file.",
+		default=None)
 	parser.add_argument(
 		"--repl", help="Drop to the python REPL after calculations are done.",
 		default=False, action="store_true")
+	add_module_opts__bj_cache(parser)
 	add_module_opts__bj_prob(parser)
+	add_module_opts__bj_stats(parser)
 	args = parser.parse_args(argv)
+	if args.hands_file:
+		try:
+			args.hands.extend(readHands(args.hands_file))
+		except ValueError as e:
+			parser.error(str(e))
+	if args.cross_check and not args.simulate:
+		parser.error("--cross-check requires --simulate")
+	if args.simulate and bj.sim.numpy is None:
+		parser.error("--simulate requires numpy")
+	if args.split_hands is not None and (args.split_hands < 2 or not args.exact):
+		parser.error("--split-hands must be at least 2, and requires --exact")
+	if args.simulate and (args.hard_totals or any(isinstance(h[0], HardTotal) for h in args.hands)):
+		parser.error("--simulate does not support hard totals")
+	if args.seats and (args.hands or args.simulate or args.format != "text" or args.target_error is not None or
+			args.approx2h or args.split_hands is not None or args.store or args.jobs != 1):
+		parser.error("--seats does not support hands, --simulate, --format, --target-error, --approx2h, "
+			"--split-hands, --store or --jobs")
+	if args.sweep and (args.seats or args.simulate or args.jobs != 1):
+		parser.error("--sweep does not support --seats, --simulate or --jobs")
+	if args.sweep_every < 1:
+		parser.error("--sweep-every must be at least 1")
+	if args.actions is not None and (not args.actions or set(args.actions) - set("HSDPU")):
+		parser.error("--actions must be some of HSDPU")
+	if args.serve and (args.hands or args.seats or args.sweep or args.simulate):
+		parser.error("--serve does not support hands, --seats, --sweep or --simulate")
+	if args.target_error is not None and (args.target_error <= 0 or args.prob_event_tolerance):
+		parser.error("--target-error must be positive, and does not support --prob-event-tolerance")
+	if args.payoffs and (args.approx2h or args.target_error is not None or args.seats or args.simulate or
+			not (args.hands or args.sweep or args.serve or args.format != "text")):
+		parser.error("--payoffs requires hands, --sweep, --serve or --format, and does not support --approx2h, "
+			"--target-error, --seats or --simulate")
+	if args.simulate and args.exact and args.count != "NullCardState":
+		parser.error("--simulate only supports --exact with --count NullCardState")
+	if args.simulate and args.format != "text":
+		parser.error("--format %s does not support --simulate" % args.format)
 
 	if args.verbose:
 		logging.getLogger().setLevel(logging.DEBUG)
 
 	rule = getattr(bj.rule, args.rule)
+	changes = dict((k, v) for k, v in [
+		("standOn", args.stand_on),
+		("hitSoft17", args.soft_17 and args.soft_17 == "hit"),
+		("push22", args.push_22 and args.push_22 == "yes"),
+		("naturalPays", args.natural_pays),
+		("actions", args.actions and tuple(a for a in "HSDPU" if a in args.actions)),
+	] if v is not None)
+	if changes:
+		rule = rule.variant(**changes)
 	cardtype = getattr(bj.card, args.count)
 	cards = cardtype(decks=args.card_decks or rule.defaultDecks, state=args.card_state)
 
-	calc = OddsCalculator(cards, rule, approx2h=args.approx2h)
-	print "%s; initial card state = %s." % (rule.name, cards)
+	store = OddsStore(args.store) if args.store else None
+	calc = OddsCalculator(cards, rule, approx2h=args.approx2h, exact=args.exact, store=store,
+		splitHands=args.split_hands, targetError=args.target_error, payoffs=args.payoffs)
+	if args.format == "text":
+		print "%s; initial card state = %s." % (rule.name, cards)
 
-	if args.hands:
-		for h in args.hands:
-			print "(%s, %s) vs House %s: %s" % (h[0], h[2], h[1], calc.calculateOdds(*h))
+	def calculate():
+		if args.serve:
+			server = makeServer(calc, args.serve, lambda state: cardtype(decks=args.card_decks or rule.defaultDecks, state=state),
+				jobs=args.jobs)
+			print >>sys.stderr, "Serving on %s" % args.serve
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+			finally:
+				server.server_close()
+		elif args.seats:
+			odds = seatOdds(rule, cards, args.seats)
+			for i in xrange(args.seats, 0, -1):
+				print "Seat %d: %+.6f%s" % (args.seats - i + 1, odds[i], errorStr(errorOf(odds[i]) or None))
+		elif args.sweep:
+			cells = [tuple(h) for h in args.hands]
+			points = sweep(calc, readShoe(args.sweep), cells, every=args.sweep_every)
+			if args.format != "text":
+				writeRecords((sweepRecord(p, cells) for p in points), sweepFields(cells), args.format)
+				return
+			for p in points:
+				print "%4d %s: %+.6f%s %s" % (p.seen, "-" if p.card is None else p.card, p.ev,
+					"" if p.variance is None else " (variance %.6f, kelly %.6f%s)" % (p.variance, p.kelly,
+						", approximate" if p.approximate else ""),
+					" ".join("%s:%s" % (cellName(cell), odds[0][0]) for cell, odds in zip(cells, p.odds)))
+				sys.stdout.flush()
+		elif args.simulate:
+			mc = MonteCarlo(calc, rounds=args.simulate, batch=args.sim_batch, seed=args.sim_seed)
+			cells = args.hands or [(h0, i, h1) for section in TABLE for h0, h1 in section for i in HOUSE_CARDS]
+			for h in cells:
+				results = mc.crossCheck(*h) if args.cross_check else mc.simulateOdds(*h)
+				print "(%s, %s) vs House %s: %s" % (h[0], h[2], h[1], ", ".join(
+					str(r) if args.cross_check else "%s %s" % r for r in results))
+		elif args.format != "text":
+			cells = [tuple(h) for h in args.hands] or [(h0, i, h1) for section in tableRows(args.hard_totals) for h0, h1 in section for i in HOUSE_CARDS]
+			writeCells(calc.calculateCells(cells, jobs=args.jobs, ordered=False), args.format)
+		elif args.hands and (args.target_error is not None or args.payoffs):
+			for c in calc.calculateCells([tuple(h) for h in args.hands]):
+				print "(%s, %s) vs House %s: %s%s" % (c.cell[0], c.cell[2], c.cell[1], c.odds, errorStr(c.error))
+				if c.payoffs is not None:
+					best = c.payoffs[c.action]
+					print "    %s pays %s; variance %.6f, kelly %.6f%s" % (c.action,
+						", ".join("%+g: %.6f" % (x, p) for x, p in sorted(best.dist)), payVariance(best), kellyFraction(best),
+						" (approximate, see --split-hands)" if c.action in c.approximate else "")
+				if c.covariance is not None:
+					print "    P hands' pays have covariance %.6f" % c.covariance
+		elif args.hands:
+			odds = {}
+			for i in sorted(set(h[1] for h in args.hands)):
+				hands = sorted(set((h[0], h[2]) for h in args.hands if h[1] == i))
+				for c in calc.calculateOddsBatch(hands, [i]):
+					odds[c.cell] = c.odds
+			for h in args.hands:
+				print "(%s, %s) vs House %s: %s" % (h[0], h[2], h[1], odds[tuple(h)])
+		else:
+			calc.printTable(jobs=args.jobs, hardTotals=args.hard_totals)
+
+	if args.profile:
+		prof = cProfile.Profile()
+		prof.runcall(calculate)
+		prof.dump_stats(args.profile)
+		pstats.Stats(prof, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
 	else:
-		calc.printTable()
+		calculate()
+
+	if bj.stats.STATS is not None:
+		if args.stats:
+			bj.stats.STATS.printTable()
+		if args.stats_json:
+			with open(args.stats_json, "w") as fp:
+				bj.stats.STATS.dump(fp)
 
 	if args.repl:
 		import code
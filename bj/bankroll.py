@@ -0,0 +1,53 @@
+"""Bet sizing from the distribution of the pay of a hand, as given by
+OddsCalculator.calculatePayoffs."""
+
+def payMean(d):
+	"""Expected pay of ProbDist([(pay, p)]) d."""
+	return d.expect(lambda x: x)
+
+def payVariance(d):
+	"""Variance of the pay of ProbDist([(pay, p)]) d, per unit bet squared."""
+	mean = payMean(d)
+	return d.expect(lambda x: (x - mean) * (x - mean))
+
+def payCovariance(d):
+	"""Covariance of the pays of the first two hands of
+	ProbDist([((pay, pay, ...), p)]) d, e.g. from splitPays, per unit bet
+	squared."""
+	mean0, mean1 = d.expect(lambda x: x[0]), d.expect(lambda x: x[1])
+	return d.expect(lambda x: (x[0] - mean0) * (x[1] - mean1))
+
+def kellyFraction(d, iterations=60):
+	"""Fraction of the bankroll to bet on a hand paying ProbDist([(pay, p)])
+	d, to maximise the expected log of the bankroll (the Kelly criterion).
+
+	That is the f in [0, 1/worst loss) where the growth rate's derivative,
+	the sum over pays x of p * x / (1 + f * x), is 0. It decreases in f, so we
+	bisect for it.
+
+	@return: 0 if the hand doesn't pay on average, 1 if it can't lose
+	"""
+	if payMean(d) <= 0:
+		return 0.0
+	dist = [(float(x), float(p)) for x, p in d.dist if p]
+	worst = min(x for x, p in dist)
+	if worst >= 0:
+		return 1.0
+	growth = lambda f: sum(p * x / (1 + f * x) for x, p in dist)
+	lo, hi = 0.0, -1.0 / worst
+	for i in xrange(iterations):
+		f = (lo + hi) / 2
+		if growth(f) > 0:
+			lo = f
+		else:
+			hi = f
+	return lo
+
+
+from bj.prob import ProbDist, ratio
+# even money with edge e: f = e
+assert abs(kellyFraction(ProbDist([(1, ratio(11, 20)), (-1, ratio(9, 20))])) - 0.1) < 1e-12
+assert kellyFraction(ProbDist([(1, ratio(1, 2)), (-1, ratio(1, 2))])) == 0
+assert kellyFraction(ProbDist.inject(1)) == 1
+assert payVariance(ProbDist([(2, ratio(1, 2)), (-2, ratio(1, 2))])) == 4
+assert payCovariance(ProbDist([((1, 1, 0), ratio(1, 2)), ((-1, -1, 0), ratio(1, 2))])) == 1
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+
+"""Default maximum number of entries kept by each LRUCache."""
+CACHE_SIZE = 65536
+
+def add_module_opts(argparser):
+	argparser.add_argument(
+		"--cache-size", help="Maximum number of entries to keep in each of "
+		"the memo caches (e.g. dealer outcomes). Least-recently-used entries "
+		"are evicted first. 0 disables caching. Default: %(default)s",
+		default=CACHE_SIZE, type=int)
+	old_parse = argparser.parse_args
+	def parse_args(*args, **kwargs):
+		global CACHE_SIZE
+		args = old_parse(*args, **kwargs)
+		CACHE_SIZE = args.cache_size
+		for cache in LRUCache.instances:
+			cache.resize(CACHE_SIZE)
+		return args
+	argparser.parse_args = parse_args
+
+class LRUCache(object):
+	"""Bounded memo cache, evicting the least-recently-used entry when full.
+
+	All instances are tracked in LRUCache.instances so that their sizes can be
+	set globally, e.g. from the command line.
+	"""
+	instances = []
+
+	def __init__(self, name, maxsize=None):
+		self.name = name
+		self.maxsize = CACHE_SIZE if maxsize is None else maxsize
+		self.data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		LRUCache.instances.append(self)
+
+	def resize(self, maxsize):
+		self.maxsize = maxsize
+		while len(self.data) > max(0, maxsize):
+			self.data.popitem(last=False)
+
+	def clear(self):
+		self.data.clear()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, f):
+		"""Look up key, calling f() to compute and store it if missing."""
+		try:
+			value = self.data.pop(key)
+		except KeyError:
+			self.misses += 1
+			value = f()
+			if self.maxsize <= 0:
+				return value
+			if len(self.data) >= self.maxsize:
+				self.data.popitem(last=False)
+		else:
+			self.hits += 1
+		self.data[key] = value
+		return value
+
+	def __len__(self):
+		return len(self.data)
+
+	def __str__(self):
+		return "%s: %s entries, %s hits, %s misses" % (self.name, len(self.data), self.hits, self.misses)
+
+# unbounded tables, such as interned card states, that clearCaches also clears
+_tables = []
+
+def registerTable(table):
+	"""Have clearCaches clear table too, and trimCaches look at its size.
+
+	@param table: anything with clear() and len(), e.g. a dict
+	@return: table
+	"""
+	_tables.append(table)
+	return table
+
+def clearCaches():
+	"""Empty every LRUCache and registered table.
+
+	They go together since cached results hold on to what the tables hold,
+	e.g. interned card states, so clearing just the tables would free little.
+	This is only worth doing between calculations, since anything in the
+	middle of one will just fill them again.
+	"""
+	for cache in LRUCache.instances:
+		# keep the counts, for --stats
+		cache.data.clear()
+	for table in _tables:
+		table.clear()
+
+def trimCaches():
+	"""clearCaches if any registered table has grown past CACHE_SIZE entries,
+	the most an LRUCache may hold. Like clearCaches, only call this between
+	calculations; long-running callers such as the server do so, so that
+	their memory use is bounded by --cache-size.
+
+	@return: whether they were cleared
+	"""
+	if any(len(table) > CACHE_SIZE for table in _tables):
+		clearCaches()
+		return True
+	return False
+
+__c = LRUCache("test", 2)
+assert [__c.get(k, lambda: k*2) for k in (1, 2, 1, 3, 1, 2)] == [2, 4, 2, 6, 2, 4]
+assert (__c.hits, __c.misses, list(__c.data)) == (2, 4, [1, 2])
+LRUCache.instances.remove(__c)
+__t = registerTable(dict.fromkeys(xrange(CACHE_SIZE + 1)))
+assert trimCaches() and not __t and not trimCaches()
+_tables.remove(__t)
@@ -1,15 +1,47 @@
 from collections import namedtuple
-from fractions import Fraction
-from bj.prob import ProbDist
+from bj.cache import registerTable
+from bj.prob import ProbDist, ratio
+
+import bj.prob
 
 class CardState(object):
 	"""State of the cards, either real or modelled. Immutable."""
+	__slots__ = ()
+
 	def draw(self, v=None):
 		"""
 		@return: ProbDist([((i, state), prob)])
 		"""
 		raise NotImplementedError()
 
+	def urn(self):
+		"""The cards left to draw from, for sampling rather than enumerating.
+
+		@return: (counts, values, replace): there are counts[i] cards left in
+		    slot i, each being one of values[i] with equal probability. If
+		    replace, cards are put back after being drawn.
+		"""
+		raise NotImplementedError()
+
+	def pooled(self, value):
+		"""A state that draws the same as this one, except that all the ranks
+		worth value or more are told apart only by how many of them are left
+		in all, e.g. for a hand that busts on any of them. Equal for any two
+		such states, so that whatever follows can be memoised on it.
+
+		By default, this state, which is always right but shares nothing.
+		"""
+		return self
+
+	def remove(self, v):
+		"""The state after drawing v, e.g. to follow a shoe as it is dealt.
+
+		Subresults are memoised on the card state, so anything calculated for
+		this state that drew v along the way is reused for the new one.
+		"""
+		(card, state), p = self.draw(v).dist[0]
+		return state
+
 class NullCardState(CardState, namedtuple('NullCardState', '')):
 	"""A game that uses infinite decks, or alternatively not counting cards."""
 	def __new__(cls, decks=1, state=None):
@@ -17,90 +49,355 @@ class NullCardState(CardState, namedtuple('NullCardState', '')):
 
 	def draw(self, v=None):
 		if v is None:
-			return ProbDist([((i, self), Fraction(1 if i != 0 else 4, 13)) for i in xrange(10)])
+			return ProbDist([((i, self), ratio(1 if i != 0 else 4, 13)) for i in xrange(10)])
 		else:
-			return ProbDist([((v, self), Fraction(1))])
+			return ProbDist([((v, self), ratio(1))])
+
+	def urn(self):
+		return ([4] + [1]*9, [[i] for i in xrange(10)], True)
 
 	def __str__(self):
 		return '(No card counting)'
 
-class TotalCardState(CardState, namedtuple('TotalCardState', 'decks total state')):
-	"""The actual state of the cards, or alternatively a perfect counter's view."""
+class TotalCardState(int, CardState):
+	"""The actual state of the cards, or alternatively a perfect counter's view.
+
+	States are interned and encoded as integers, so hashing and comparing them
+	(e.g. as part of a GameState) is cheap: the low byte is the number of
+	decks, and the rest is the number of cards drawn of each rank, in mixed
+	radix. Drawing a card is then just an addition, and the results of draw
+	are cached per state.
+
+	The code is all that is kept per state: the counts are decoded from it
+	when needed, and draw results are kept in one table per kind of draw
+	rather than a slot for every kind in every state, so a deep enumeration
+	costs little more than an int per card state it reaches.
+
+	Attributes:
+		decks: Number of decks in play, less than 256.
+		total: Number of cards of each rank, when none have been drawn.
+		state: Number of cards of each rank that have been drawn.
+	"""
+	__slots__ = ()
+
+	# interned states, keyed by their integer code
+	_states = registerTable({})
+	# draw results keyed by state, one table for each kind of draw, see draw
+	_draws = [registerTable({}) for k in xrange(22)]
+	# (total, weight of each rank in the code) keyed by decks
+	_radix = {}
+	# pooled results keyed by (state, value)
+	_pooled = registerTable({})
+
 	def __new__(cls, decks=6, state=None):
-		self = super(TotalCardState, cls).__new__(cls, decks, tuple([16*decks] + ([4*decks]*9)), tuple(state or [0]*10))
-		if any(self.state[i] > self.total[i] for i in xrange(10)):
-			raise ValueError
-		return self
+		if not 0 < decks < 256: raise ValueError("decks must be from 1 to 255: %r" % (decks,))
+		total, weights = cls.__radix(decks)
+		state = tuple(state or [0]*10)
+		if len(state) != 10 or any(not 0 <= state[i] <= total[i] for i in xrange(10)):
+			raise ValueError("state must be the number drawn of each of the 10 ranks, at most %r: %r" % (total, state))
+		return cls.__intern(decks + sum(s * w for s, w in zip(state, weights)))
+
+	@classmethod
+	def __radix(cls, decks):
+		try:
+			return cls._radix[decks]
+		except KeyError:
+			total = tuple([16*decks] + ([4*decks]*9))
+			weights = [256]
+			for t in total[:-1]:
+				weights.append(weights[-1] * (t + 1))
+			cls._radix[decks] = (total, tuple(weights))
+			return cls._radix[decks]
+
+	@classmethod
+	def __intern(cls, code):
+		try:
+			return cls._states[code]
+		except KeyError:
+			self = cls._states[code] = int.__new__(cls, code)
+			return self
+
+	decks = property(lambda self: self & 255)
+	total = property(lambda self: TotalCardState.__radix(self & 255)[0])
+
+	@property
+	def state(self):
+		code = self >> 8
+		state = []
+		for t in self.total:
+			code, s = divmod(code, t + 1)
+			state.append(s)
+		return tuple(state)
 
 	def __mknext(self, i):
-		newstate = list(self.state)
-		newstate[i] += 1
-		return (i, self.__class__(self.decks, newstate))
+		code = self + TotalCardState.__radix(self & 255)[1][i]
+		try:
+			return (i, TotalCardState._states[code])
+		except KeyError:
+			return (i, TotalCardState.__intern(code))
 
 	def draw(self, v=None):
-		cardsleft = self.decks * 52 - sum(self.state)
+		# ProbDists made with different PROB_RATIONAL settings have different
+		# probability types, so cache them separately
+		k = (10 if v is None else v) + 11 * bool(bj.prob.PROB_RATIONAL)
+		draws = TotalCardState._draws[k]
+		d = draws.get(self)
+		if d is None:
+			d = draws[self] = self.__draw(v)
+		return d
+
+	def __draw(self, v):
+		total, state = self.total, self.state
+		cardsleft = self.decks * 52 - sum(state)
 		dist = []
 		if v is None:
 			for i in xrange(10):
-				prob = Fraction(self.total[i] - self.state[i], cardsleft)
+				prob = ratio(total[i] - state[i], cardsleft)
 				if not prob: continue
 				dist.append((self.__mknext(i), prob))
 		else:
-			prob = Fraction(self.total[v] - self.state[v], cardsleft)
-			if not prob: raise ValueError()
-			dist.append((self.__mknext(v), Fraction(1)))
+			prob = ratio(total[v] - state[v], cardsleft)
+			if not prob: raise ValueError("no %d left to draw" % v)
+			dist.append((self.__mknext(v), ratio(1)))
 		return ProbDist(dist)
 
+	def pooled(self, value):
+		key = (self, value)
+		try:
+			return TotalCardState._pooled[key]
+		except KeyError:
+			pass
+		# the ranks worth value or more, 10 (i.e. 0) first; the ace is worth 1
+		ranks = [i for i in (0, 9, 8, 7, 6, 5, 4, 3, 2) if (i or 10) >= value]
+		total, weights = TotalCardState.__radix(self & 255)
+		state = self.state
+		drawn = sum(state[i] for i in ranks)
+		code = self
+		# count the cards drawn from them as drawn from the first ones
+		for i in ranks:
+			s = min(drawn, total[i])
+			code += (s - state[i]) * weights[i]
+			drawn -= s
+		pooled = TotalCardState._pooled[key] = TotalCardState.__intern(code)
+		return pooled
+
+	def urn(self):
+		return ([t - s for t, s in zip(self.total, self.state)], [[i] for i in xrange(10)], False)
+
+	def __reduce__(self):
+		return (TotalCardState, (self.decks, self.state))
+
+	def __repr__(self):
+		return "TotalCardState(decks=%r, state=%r)" % (self.decks, self.state)
+
 	def __str__(self):
 		return repr(self.state)
 
-class PartialAJHLCardState(CardState, namedtuple('PartialAJHLCardState', 'decks total state')):
-	"""Counts tens (10JQK), aces, lo (2345), hi (6789) separately."""
+class BucketCardState(int, CardState):
+	"""A card counter's view of the cards: the ranks are sorted into buckets,
+	and only the number of cards drawn from each bucket is kept. A card drawn
+	from a bucket is each of its ranks in proportion to how many of them a
+	full deck has.
+
+	Each counting system is a subclass, made by countingSystem from its
+	buckets. States are interned and encoded as integers as for
+	TotalCardState, with the buckets in place of the ranks, so drawing costs
+	the same as for a TotalCardState with that many ranks: the state after
+	drawing from each bucket is just an addition, worked out once per system
+	and number of decks, and the results of draw are cached per state. Codes
+	are negative and include the system, so no two states of different
+	systems (or a TotalCardState) are equal as keys in the caches.
+
+	Attributes:
+		decks: Number of decks in play, less than 256.
+		total: Number of cards in each bucket, when none have been drawn.
+		state: Number of cards that have been drawn from each bucket.
+		count: The running count, i.e. the sum of the tag of each bucket
+		    times the cards drawn from it, or None if the system has no tags.
+	"""
+	__slots__ = ()
+
+	# set for each system by countingSystem
+	buckets = ()
+	tags = None
+
 	def __new__(cls, decks=6, state=None):
-		if type(decks) != int: raise ValueError
-		self = super(PartialAJHLCardState, cls).__new__(cls, decks, tuple(4*decks*x for x in [4,1,4,4]), tuple(state or [0]*4))
-		if any(self.state[i] > self.total[i] for i in xrange(4)):
-			raise ValueError
-		return self
+		if type(decks) != int or not 0 < decks < 256: raise ValueError("decks must be from 1 to 255: %r" % (decks,))
+		total, steps = cls.__radix(decks)
+		state = tuple(state or [0]*len(total))
+		if len(state) != len(total) or any(not 0 <= s <= t for s, t in zip(state, total)):
+			raise ValueError("state must be the number drawn from each of the %d buckets, at most %r: %r" % (
+				len(total), total, state))
+		return cls.__intern(-(decks + 256 * cls._system) + sum(s * w for s, w in zip(state, steps)))
 
-	def __mknext(self, i, v):
-		newstate = list(self.state)
-		newstate[i] += 1
-		return (v, self.__class__(self.decks, newstate))
+	@classmethod
+	def __radix(cls, decks):
+		"""
+		@return: (total, steps): the cards in each bucket, and what drawing
+		    one from it adds to the code
+		"""
+		try:
+			return cls._radix[decks]
+		except KeyError:
+			total = tuple(decks * sum(16 if v == 0 else 4 for v in ranks) for ranks in cls.buckets)
+			weights = [1]
+			for t in total[:-1]:
+				weights.append(weights[-1] * (t + 1))
+			cls._radix[decks] = (total, tuple(-65536 * w for w in weights))
+			return cls._radix[decks]
+
+	@classmethod
+	def __intern(cls, code):
+		try:
+			return cls._states[code]
+		except KeyError:
+			self = cls._states[code] = int.__new__(cls, code)
+			return self
+
+	decks = property(lambda self: -self & 255)
+	total = property(lambda self: self.__radix(-self & 255)[0])
+
+	@property
+	def state(self):
+		code = -self >> 16
+		state = []
+		for t in self.total:
+			code, s = divmod(code, t + 1)
+			state.append(s)
+		return tuple(state)
+
+	@property
+	def count(self):
+		if self.tags is None:
+			return None
+		return sum(t * s for t, s in zip(self.tags, self.state))
+
+	def __mknext(self, i):
+		code = self + self.__radix(-self & 255)[1][i]
+		try:
+			return self._states[code]
+		except KeyError:
+			return self.__intern(code)
 
 	def draw(self, v=None):
-		cardsleft = self.decks * 52 - sum(self.state)
+		# as for TotalCardState
+		k = (10 if v is None else v) + 11 * bool(bj.prob.PROB_RATIONAL)
+		draws = self._draws[k]
+		d = draws.get(self)
+		if d is None:
+			d = draws[self] = self.__draw(v)
+		return d
+
+	def __draw(self, v):
+		total, state = self.total, self.state
+		cardsleft = self.decks * 52 - sum(state)
 		dist = []
 		if v is None:
-			for i in xrange(4):
-				prob = Fraction(self.total[i] - self.state[i], cardsleft)
+			for i, shares in enumerate(self._shares):
+				prob = ratio(total[i] - state[i], cardsleft)
 				if not prob: continue
-				if i == 0 or i == 1:
-					dist.append((self.__mknext(i, i), prob))
-				elif i == 2: # 2,3,4,5
-					for j in xrange(4):
-						dist.append((self.__mknext(i, 2+j), prob/4))
-				elif i == 3: # 6,7,8,9
-					for j in xrange(4):
-						dist.append((self.__mknext(i, 6+j), prob/4))
+				nextstate = self.__mknext(i)
+				if len(shares) == 1:
+					dist.append(((shares[0][0], nextstate), prob))
+				else:
+					for card, (n, d) in shares:
+						dist.append(((card, nextstate), prob * ratio(n, d)))
 		else:
-			if v == 0 or v == 1:
-				i = v
-			elif 2 <= v <= 5:
-				i = 2
-			elif 6 <= v <= 9:
-				i = 3
-			prob = Fraction(self.total[i] - self.state[i], cardsleft)
-			if not prob: raise ValueError()
-			dist.append((self.__mknext(i, v), Fraction(1)))
+			i = self._bucketOf[v]
+			prob = ratio(total[i] - state[i], cardsleft)
+			if not prob: raise ValueError("no %d left to draw" % v)
+			dist.append(((v, self.__mknext(i)), ratio(1)))
 		return ProbDist(dist)
 
+	def urn(self):
+		# each rank repeated as often as it makes up its bucket
+		values = [sum([[card] * n for card, (n, d) in shares], []) for shares in self._shares]
+		return ([t - s for t, s in zip(self.total, self.state)], values, False)
+
+	def __reduce__(self):
+		return (self.__class__, (self.decks, self.state))
+
+	def __repr__(self):
+		return "%s(decks=%r, total=%r, state=%r)" % (self.__class__.__name__, self.decks, self.total, self.state)
+
 	def __str__(self):
 		return repr(self.state)
 
+def countingSystem(name, buckets, tags=None, doc=None):
+	"""Make a BucketCardState for a counting system.
+
+	@param name: name of the class, which must also be the name it is
+	    bound to in this module so that its states can be pickled
+	@param buckets: list of the ranks in each bucket, each rank in exactly
+	    one of them
+	@param tags: what drawing a card from each bucket adds to the running
+	    count, or None
+	"""
+	if sorted(v for ranks in buckets for v in ranks) != range(10): raise ValueError
+	if tags is not None and len(tags) != len(buckets): raise ValueError
+	system = len(BucketCardState.__subclasses__()) + 1
+	if system > 255: raise ValueError
+	shares = []
+	for ranks in buckets:
+		# each rank's share of the bucket, in lowest terms
+		counts = [4 if v == 0 else 1 for v in ranks]
+		d = sum(counts)
+		shares.append(tuple((v, (n, d)) for v, n in zip(ranks, counts)))
+	return type(name, (BucketCardState,), {
+		"__slots__": (),
+		"__module__": __name__,
+		"__doc__": doc,
+		"buckets": tuple(tuple(ranks) for ranks in buckets),
+		"tags": None if tags is None else tuple(tags),
+		"_system": system,
+		# interned states, keyed by their integer code
+		"_states": registerTable({}),
+		# draw results keyed by state, one table for each kind of draw
+		"_draws": [registerTable({}) for k in xrange(22)],
+		# (total, steps) keyed by decks
+		"_radix": {},
+		# (card, (n, d)): card is n/d of the cards in the bucket, per bucket
+		"_shares": tuple(shares),
+		# bucket of each card
+		"_bucketOf": tuple(next(i for i, ranks in enumerate(buckets) if v in ranks) for v in xrange(10)),
+	})
+
+PartialAJHLCardState = countingSystem("PartialAJHLCardState", [[0], [1], [2, 3, 4, 5], [6, 7, 8, 9]],
+	doc="""Counts tens (10JQK), aces, lo (2345), hi (6789) separately.""")
+
+HiLoCardState = countingSystem("HiLoCardState", [[2, 3, 4, 5, 6], [7, 8, 9], [0, 1]], [1, 0, -1],
+	doc="""Hi-Lo: lo (23456) count +1, 789 count 0, hi (10JQKA) count -1.
+
+	Each bucket is counted separately, so besides the running count this
+	knows how many cards are left, i.e. the true count.""")
+
+KOCardState = countingSystem("KOCardState", [[2, 3, 4, 5, 6, 7], [8, 9], [0, 1]], [1, 0, -1],
+	doc="""Knock-Out: lo (234567) count +1, 89 count 0, hi (10JQKA) count -1.""")
+
+OmegaIICardState = countingSystem("OmegaIICardState", [[2, 3, 7], [4, 5, 6], [1, 8], [9], [0]], [1, 2, 0, -1, -2],
+	doc="""Omega II: 237 count +1, 456 count +2, A8 count 0, 9 count -1 and
+	10JQK count -2.""")
+
+"""Card states that can be chosen by name, e.g. with bj.py --count."""
+COUNTS = ["NullCardState", "TotalCardState", "PartialAJHLCardState", "HiLoCardState", "KOCardState", "OmegaIICardState"]
+
 c = TotalCardState()
 assert c.total == (96, 24, 24, 24, 24, 24, 24, 24, 24, 24)
 assert c.state == (0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 n = c.draw()
 assert n.dist[0][0][1].state == (1, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 assert n.dist[1][0][1].state == (0, 1, 0, 0, 0, 0, 0, 0, 0, 0)
+assert c.draw(1).dist[0][0][1] is TotalCardState(6, [0, 1] + [0]*8)
+assert c.draw() is c.draw()
+assert TotalCardState(8, [3, 0, 2] + [0]*6 + [32]).state == (3, 0, 2) + (0,)*6 + (32,)
+assert c.remove(1) is c.draw(1).dist[0][0][1]
+assert TotalCardState(1, [0]*7 + [1, 1, 0]).pooled(7) is TotalCardState(1, [2] + [0]*9) is TotalCardState(1, [2] + [0]*9).pooled(7)
+assert TotalCardState(1, [16, 0, 0, 0, 0, 0, 0, 0, 0, 3]).pooled(9).state == (16, 0, 0, 0, 0, 0, 0, 0, 0, 3) and c.pooled(11) is c
+b = PartialAJHLCardState(2)
+assert b.total == (32, 8, 32, 32) and b.decks == 2
+assert [(card, nextcards.state, p) for (card, nextcards), p in b.draw().dist[:3]] == [(0, (1, 0, 0, 0), ratio(32, 104)), (1, (0, 1, 0, 0), ratio(8, 104)), (2, (0, 0, 1, 0), ratio(32, 104) / 4)]
+assert b.remove(7) is PartialAJHLCardState(2, [0, 0, 0, 1]) and b.draw() is b.draw()
+assert b != TotalCardState(2) and b != HiLoCardState(2) and PartialAJHLCardState(2, [3, 2, 1, 0]).state == (3, 2, 1, 0)
+assert dict((card, p) for (card, nextcards), p in HiLoCardState(1).draw().dist) == dict((card, ratio(16 if card == 0 else 4, 52)) for card in xrange(10))
+assert OmegaIICardState(1).remove(4).remove(0).remove(9).count == -1
+assert HiLoCardState(1).urn()[1][2] == [0, 0, 0, 0, 1]
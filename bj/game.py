@@ -1,8 +1,13 @@
 from collections import namedtuple
+from bj.cache import registerTable
 from bj.prob import ProbDist
 from bj.hand import Hand as H
+from bj.stats import timed
 
 
+# hands tuples, shared by every GameState that holds the same hands
+_hands = registerTable({})
+
 class GameState(namedtuple('GameState', 'cards hands turn done')):
 	"""State of the game. Immutable.
 
@@ -14,12 +19,19 @@ class GameState(namedtuple('GameState', 'cards hands turn done')):
 			Index into self.hands for the current player whose turn it is.
 		done:
 			Whether the current player's turn is done.
+
+	The card state and hands are interned, and so is the hands tuple, so the
+	events of a GameStateDist share all of their structure apart from the
+	GameState itself.
 	"""
+	__slots__ = ()
+
 	def __new__(cls, cards, hands, turn=None, done=False):
 		if not hands or len(hands) < 2: raise ValueError
 		if turn is None: turn = len(hands) - 1
 		if not 0 <= turn < len(hands): raise ValueError
-		return super(GameState, cls).__new__(cls, cards, tuple(hands), turn, done)
+		hands = tuple(hands)
+		return super(GameState, cls).__new__(cls, cards, _hands.setdefault(hands, hands), turn, done)
 
 	def isDealComplete(self):
 		"""Has everyone been dealt 2 cards."""
@@ -46,6 +58,12 @@ class GameState(namedtuple('GameState', 'cards hands turn done')):
 	def __str__(self):
 		return "%s %s : P%s %s" % (",".join("%4s" % str(h) for h in self.hands), self.cards, self.turn, 'played' if self.done else 'to play')
 
+	def canonical(self):
+		"""This state with every hand reduced to its canonical hand, for once
+		the decisions that only 2-card hands get are made, see Hand.canonical.
+		"""
+		return self.__class__(self.cards, [h.canonical() for h in self.hands], self.turn, self.done)
+
 	def currentHand(self):
 		"""Get the hand of the current player."""
 		return self.hands[self.turn]
@@ -96,6 +114,7 @@ class GameState(namedtuple('GameState', 'cards hands turn done')):
 
 
 class GameStateDist(ProbDist):
+	__slots__ = ()
 
 	@classmethod
 	def initGame(cls, numHands, initCards):
@@ -127,6 +146,7 @@ class GameStateDist(ProbDist):
 			gsd = gsd.bind(f)
 		return gsd
 
+	@timed("execRound")
 	def execRound(self, strats, r=None):
 		gsd = self
 		if r is None:
@@ -140,17 +160,21 @@ class GameStateDist(ProbDist):
 			gsd = gsd.map(GameState.nextTurn)
 		return gsd
 
+	@timed("dealNewRound")
 	def dealNewRound(self, cards=None):
+		"""Deal everyone 2 cards, in turn.
+
+		@param cards: the cards to deal, in order; None or running out of them
+		    means drawing at random
+		"""
 		gsd = self
 		gsd = gsd.map(GameState.newGame)
-		hit = lambda gs: gs.hit(cards.pop(0) if cards else None)
+		cards = list(cards or [])
 		for i in xrange(2 * self.numPlayers()):
-			gsd = gsd.bind(hit).map(GameState.turnDoneNext)
+			# the same card for every state, however many earlier random
+			# draws there were
+			v = cards.pop(0) if cards else None
+			gsd = gsd.bind(lambda gs: gs.hit(v)).map(GameState.turnDoneNext)
 		assert gsd.allDealComplete()
 		return gsd
 
-
-from bj.card import TotalCardState
-from bj.rule import BJS
-assert GameStateDist.inject(GameState(TotalCardState(), [H(1,10,0,1),H(0,20,0,0)], 0))._playUntilDone(BJS.playHouse).expectPay(BJS.pay)[1] == -1.0
-assert GameStateDist.inject(GameState(TotalCardState(), [H(1,10,0,1),H(1,10,0,1)], 0))._playUntilDone(BJS.playHouse).expectPay(BJS.pay)[1] == 0.0
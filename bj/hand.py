@@ -1,8 +1,17 @@
 from collections import namedtuple
 
-class Hand(namedtuple('Hand', 'ace osum fst snd')):
+class HandKey(namedtuple('HandKey', 'ace osum fst snd')):
+	"""The attributes of a Hand, see Hand for details."""
+	pass
+
+class Hand(int):
 	"""A hand of cards.
 
+	Hands are interned and encoded as small integers, so hashing and comparing
+	them is cheap, and add, value and the is* predicates are all lookups into
+	tables that are filled in when the hand is first created. All hands that
+	can be reached from Hand() are created when this module is loaded.
+
 	Attributes:
 		ace:
 			Whether we have an ace. (We only care about having one ace, since
@@ -15,47 +24,89 @@ class Hand(namedtuple('Hand', 'ace osum fst snd')):
 		snd:
 			Second card dealt, or None if 0, 1 or 3+ cards have been dealt.
 	"""
+	__slots__ = ()
+
+	# tables indexed by the integer code of the hand; code 0 is unused so
+	# that all hands are truthy
+	_codes = {}
+	_hands = [None]
+	_keys = [None]
+	_value = [None]
+	_dealt = [None]
+	_bust = [None]
+	_nat = [None]
+	_a17 = [None]
+	_is22 = [None]
+	_add = [None]
+	_canonical = [None]
+
 	def __new__(cls, ace=False, osum=0, fst=None, snd=None):
-		return super(Hand, cls).__new__(cls, bool(ace), min(23, osum), fst, snd)
+		key = HandKey(bool(ace), min(23, osum), fst, snd)
+		try:
+			return cls._hands[cls._codes[key]]
+		except KeyError:
+			return cls.__intern(key)
+
+	@classmethod
+	def __intern(cls, key):
+		ace, osum, fst, snd = key
+		code = len(cls._hands)
+		self = int.__new__(cls, code)
+		cls._codes[key] = code
+		cls._hands.append(self)
+		cls._keys.append(key)
+		cls._value.append(osum if not ace else osum + 1 if osum >= 11 else osum + 11)
+		dealt = 2 if snd is not None else 1 if fst is not None else 3 if ace or osum else 0
+		cls._dealt.append(dealt)
+		cls._bust.append(osum >= 22 if not ace else osum >= 21)
+		cls._nat.append(ace and osum == 10 and dealt == 2)
+		cls._a17.append(ace and osum == 6)
+		cls._is22.append(osum == 22 if not ace else osum in (11, 21))
+		cls._add.append(None)
+		cls._canonical.append(None)
+		return self
+
+	@classmethod
+	def all(cls):
+		"""All hands created so far, indexed by their integer code."""
+		return cls._hands
+
+	ace = property(lambda self: Hand._keys[self].ace)
+	osum = property(lambda self: Hand._keys[self].osum)
+	fst = property(lambda self: Hand._keys[self].fst)
+	snd = property(lambda self: Hand._keys[self].snd)
 
 	@property
 	def value(self):
 		"""The "best" value for this hand, i.e. closest to but leq than 21."""
-		return self.osum if not self.ace else self.osum + 1 if self.osum >= 11 else self.osum + 11
+		return Hand._value[self]
 
 	def cardsDealt(self):
 		"""Number of cards dealt in this hand.
 
 		A return-value of 3 means "3 or greater".
 		"""
-		if self.snd is not None:
-			return 2
-		if self.fst is not None:
-			return 1
-		if self.ace or self.osum:
-			return 3
-		else:
-			return 0
+		return Hand._dealt[self]
 
 	def isDealComplete(self):
-		return self.cardsDealt() >= 2
+		return Hand._dealt[self] >= 2
 
 	def isBust(self):
-		return self.osum >= 22 if not self.ace else self.osum >= 21
+		return Hand._bust[self]
 
 	def isNat(self):
 		# TODO: return false after switching
-		return self.ace and self.osum == 10 and self.cardsDealt() == 2
+		return Hand._nat[self]
 
 	def isA17(self):
-		return self.ace and self.osum == 6
+		return Hand._a17[self]
 
 	def is22(self):
 		# 22s are treated specially in Blackjack Switch, so account for them here
-		return self.osum == 22 if not self.ace else self.osum in (11, 21)
+		return Hand._is22[self]
 
 	def canHit(self):
-		return not self.isNat() and not self.isBust()
+		return not Hand._nat[self] and not Hand._bust[self]
 
 	def add(self, x):
 		"""Add a card to this hand.
@@ -64,7 +115,13 @@ class Hand(namedtuple('Hand', 'ace osum fst snd')):
 			x: The card being added. 1 is ace, and 0 is 10/J/Q/K. Other values
 			represent the cards with that face value.
 		"""
-		ace, osum, fst, snd = self.ace, self.osum, self.fst, self.snd
+		row = Hand._add[self]
+		if row is None:
+			row = Hand._add[self] = [self.__add(i) for i in xrange(10)]
+		return row[x] if x is not None else self.__add(x)
+
+	def __add(self, x):
+		ace, osum, fst, snd = Hand._keys[self]
 		num = self.cardsDealt()
 		if x == 1 and not ace:
 			ace = True
@@ -78,6 +135,33 @@ class Hand(namedtuple('Hand', 'ace osum fst snd')):
 			fst, snd = None, None
 		return self.__class__(ace, osum, fst, snd)
 
+	def canonical(self):
+		"""The simplest hand that plays and pays the same as this one, once
+		the decisions that only 2-card hands get (double, split) are made.
+
+		That is just the total for any hand of 2+ cards, so e.g. (2,9), (9,2)
+		and (3,8) are all the same hand of 11, except that naturals are kept
+		as they are, and busts only as far as is22. Hands of 0 or 1 cards are
+		left alone, since they are still to be dealt to.
+		"""
+		h = Hand._canonical[self]
+		if h is None:
+			h = Hand._canonical[self] = self.__canonical()
+		return h
+
+	def __canonical(self):
+		if not self.isDealComplete() or self.isNat():
+			return self
+		if self.isBust():
+			return self.__class__(False, 22 if self.is22() else 23)
+		return self.__class__(self.ace, self.osum)
+
+	def __reduce__(self):
+		return (Hand, tuple(Hand._keys[self]))
+
+	def __repr__(self):
+		return "Hand(ace=%r, osum=%r, fst=%r, snd=%r)" % Hand._keys[self]
+
 	@staticmethod
 	def cardsToStr(*it):
 		return ''.join(('?' if x is None else 'A' if x == 1 else 'J' if x == 0 else str(x)) for x in it)
@@ -93,6 +177,14 @@ class Hand(namedtuple('Hand', 'ace osum fst snd')):
 			orig = ''
 		return "%s%s%s" % ('' if not self.ace else 'A', self.osum, orig)
 
+def __reachable():
+	todo = [Hand()]
+	while todo:
+		h = todo.pop()
+		if Hand._add[h] is None:
+			todo.extend(h.add(i) for i in xrange(10))
+__reachable()
+
 assert Hand().cardsDealt() == 0
 assert Hand().add(2).cardsDealt() == 1
 assert Hand().add(1).cardsDealt() == 1
@@ -101,3 +193,8 @@ assert Hand().add(1).add(0).cardsDealt() == 2
 assert Hand().add(0).add(1).cardsDealt() == 2
 assert Hand().add(0).add(1).add(2).cardsDealt() == 3
 assert Hand(1, 10).value == 21
+assert Hand(1, 10, 0, 1) is Hand().add(0).add(1)
+assert Hand(0, 30).osum == 23
+assert Hand().add(2).add(9).canonical() is Hand().add(9).add(2).canonical() is Hand(0, 11)
+assert Hand().add(1).add(0).canonical().isNat() and Hand().add(6).canonical() is Hand().add(6)
+assert Hand(1, 21).canonical() is Hand(0, 22) and Hand(1, 22).canonical() is Hand(0, 23)
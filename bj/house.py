@@ -0,0 +1,142 @@
+import bj.prob
+
+from contextlib import contextmanager
+
+from bj.cache import LRUCache
+from bj.hand import Hand as H
+from bj.prob import ProbDist
+from bj.stats import timed, timer
+
+"""Canonical finished house hands, see houseOutcome."""
+NATURAL = H(1, 10, 1, 0)
+BUST22 = H(0, 22)
+BUST = H(0, 23)
+
+def houseOutcome(h):
+	"""Reduce a finished house hand to a canonical hand that pays the same.
+
+	Rules only look at isBust, is22, isNat and value of the house hand, so all
+	finished hands collapse into: natural, a plain total (17-21 for the rules
+	we have), 22 and bust.
+	"""
+	if h.isNat():
+		return NATURAL
+	if h.isBust():
+		return BUST22 if h.is22() else BUST
+	return H(0, h.value)
+
+def houseHand(houseCard):
+	"""The house's hand before its hole card is drawn.
+
+	@param houseCard: its up card, or None if that isn't known either, in which
+	    case the house draws both of its cards once the players are done
+	"""
+	return H() if houseCard is None else H().add(houseCard)
+
+@timed("playHouse")
+def _playHouse(rule, h, cards):
+	if h.isDealComplete() and not rule.houseHits(h):
+		return ProbDist.inject(houseOutcome(h))
+	# recurse through houseOutcomes so that subtrees are memoised too
+	return cards.draw().bind(lambda (card, nextcards): houseOutcomes(rule, h.add(card), nextcards))
+
+_outcomes = LRUCache("house outcomes")
+# outcomes kept whatever --cache-size, see pinnedOutcomes
+_pinned = None
+
+@contextmanager
+def pinnedOutcomes():
+	"""Keep every houseOutcomes result looked up in this block until it ends,
+	even ones the LRU cache evicts, so that each house tree is only played
+	out once for everything calculated in it, e.g. a batch of hands against
+	one up card."""
+	global _pinned
+	if _pinned is not None:
+		yield
+		return
+	_pinned = {}
+	try:
+		yield
+	finally:
+		_pinned = None
+
+def houseOutcomes(rule, h, cards):
+	"""Distribution of finished house hands, as canonicalised by houseOutcome.
+
+	This only depends on the rule, the house hand and the card state, so it is
+	memoised across all callers (and the current PROB_EVENT_TOLERANCE, which
+	the outcomes are pruned with). The house hand is reduced to its canonical
+	hand first, so e.g. a 5 under a 6 and a 6 under a 5 share the same subtree
+	when they leave the same cards, and the ranks that would bust it are
+	pooled (see CardState.pooled), so e.g. a hard 16 shares its subtree with
+	every state that differs only in which 7s to 10s were drawn.
+
+	@param h: the house hand so far. If the hole card hasn't been dealt yet,
+	    it is drawn from cards.
+	@return: ProbDist([(Hand, p)])
+	"""
+	h = h.canonical()
+	if h.isDealComplete():
+		# any card that takes the house past 22 just busts it, so it doesn't
+		# matter which of those ranks are left, only how many
+		cards = cards.pooled(23 - h.osum - h.ace)
+	# the house's play, which GameStateDist.execRound used to time
+	key = (rule, h, cards, bj.prob.PROB_EVENT_TOLERANCE)
+	with timer("execRound"):
+		if _pinned is None:
+			return _outcomes.get(key, lambda: _playHouse(rule, h, cards))
+		try:
+			return _pinned[key]
+		except KeyError:
+			outcomes = _pinned[key] = _outcomes.get(key, lambda: _playHouse(rule, h, cards))
+			return outcomes
+
+class PayTable(object):
+	"""rule.pay for every house hand against every player hand.
+
+	Rows (one per house hand) are filled in on first use.
+	"""
+	def __init__(self, rule):
+		self.rule = rule
+		self.rows = {}
+
+	def pay(self, h, p):
+		try:
+			return self.rows[h][p]
+		except KeyError:
+			self.rows[h] = [None] + [self.rule.pay(h, q) for q in H.all()[1:]]
+		except IndexError:
+			pass # p was created after the row was filled in
+		return self.rule.pay(h, p)
+
+_payTables = {}
+
+def payTable(rule):
+	if rule not in _payTables:
+		_payTables[rule] = PayTable(rule)
+	return _payTables[rule]
+
+def expectPay(rule, p, outcomes):
+	"""Expected pay for player hand p against a distribution of house outcomes.
+
+	Bounded if some of the outcomes were pruned, see ProbDist.expect.
+	"""
+	pay = payTable(rule).pay
+	return outcomes.expect(lambda h: pay(h, p), rule.maxPay)
+
+def standPay(rule, p, h, cards):
+	"""Expected pay for player hand p standing against house hand h."""
+	if p.isBust():
+		# a bust player loses whatever the house does, don't bother playing it
+		return payTable(rule).pay(BUST, p)
+	return expectPay(rule, p, houseOutcomes(rule, h, cards))
+
+
+from bj.card import TotalCardState
+from bj.rule import BJS
+assert houseOutcome(H(1, 10, 0, 1)) == NATURAL
+assert houseOutcome(H(1, 21)) == BUST22
+assert payTable(BJS).pay(BUST22, H(0, 21)) == 0 and payTable(BJS).pay(BUST, H(0, 21)) == 1
+assert expectPay(BJS, H(0, 20, 0, 0), houseOutcomes(BJS, H(1, 10, 0, 1), TotalCardState())) == -1.0
+assert expectPay(BJS, H(1, 10, 0, 1), houseOutcomes(BJS, H(1, 10, 0, 1), TotalCardState())) == 0.0
+assert standPay(BJS, H(0, 23), H(0, 2), TotalCardState()) == -1
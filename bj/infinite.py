@@ -0,0 +1,136 @@
+from bj.card import NullCardState
+from bj.hand import Hand
+from bj.house import BUST, houseHand, houseOutcome, payTable
+from bj.prob import ProbDist, ratio
+from bj.stats import timer
+
+class InfiniteDeck(object):
+	"""Odds for NullCardState, worked out directly over hands.
+
+	With no card counting every draw has the same distribution, so there is
+	no card state to track: the finished house hands for each up card are a
+	small Markov chain that is solved once per rule into a table, and the
+	player's hit/stand values are dynamic programs over the player's hand
+	alone, memoised per up card in plain dicts rather than going through
+	ProbDist binds. The results are the same as the general calculation's for
+	NullCardState, but a whole table takes milliseconds rather than seconds.
+
+	Tables are keyed by up card, with None for a house that hasn't been dealt
+	any cards yet, see houseHand.
+	"""
+
+	def __init__(self, rule):
+		self.rule = rule
+		self.cards = NullCardState()
+		self.draws = [(card, p) for (card, nextcards), p in self.cards.draw().dist]
+		self._house = {}
+		upcards = range(10) + [None]
+		with timer("execRound"):
+			self.outcomes = dict((i, self._houseOutcomes(houseHand(i)).items()) for i in upcards)
+		# values for each player hand, one dict per up card
+		self._stand = dict((i, {}) for i in upcards)
+		self._hitOnce = dict((i, {}) for i in upcards)
+		self._hit = dict((i, {}) for i in upcards)
+		self._optimal = dict((i, {}) for i in upcards)
+
+	def _houseOutcomes(self, h):
+		"""Like houseOutcomes, as a dict of outcome to probability."""
+		h = h.canonical()
+		try:
+			return self._house[h]
+		except KeyError:
+			pass
+		if h.isDealComplete() and not self.rule.houseHits(h):
+			outcomes = {houseOutcome(h): 1}
+		else:
+			outcomes = {}
+			for card, p in self.draws:
+				for o, q in self._houseOutcomes(h.add(card)).iteritems():
+					outcomes[o] = outcomes.get(o, 0) + p * q
+		self._house[h] = outcomes
+		return outcomes
+
+	def deal(self, playerCard0, playerCard1=None):
+		"""Like dealPlayer; the house's up card doesn't change the cards.
+
+		@return: ProbDist([((player hand, card state), p)])
+		"""
+		hands = [(Hand(), ratio(1))]
+		for v in (playerCard0, playerCard1):
+			draws = self.draws if v is None else [(v, 1)]
+			hands = [(p.add(card), q * r) for p, q in hands for card, r in draws]
+		return ProbDist([((p, self.cards), q) for p, q in hands])
+
+	def standValue(self, p, houseCard):
+		pay = payTable(self.rule).pay
+		if p.isBust():
+			return pay(BUST, p)
+		stand = self._stand[houseCard]
+		if p not in stand:
+			stand[p] = sum(q * pay(h, p) for h, q in self.outcomes[houseCard])
+		return stand[p]
+
+	def hitOnceValue(self, p, houseCard):
+		if not p.canHit():
+			return self.standValue(p, houseCard)
+		hitOnce = self._hitOnce[houseCard]
+		if p not in hitOnce:
+			hitOnce[p] = sum(q * self.standValue(p.add(card), houseCard) for card, q in self.draws)
+		return hitOnce[p]
+
+	def hitValue(self, p, houseCard):
+		if not p.canHit():
+			return self.standValue(p, houseCard)
+		hit = self._hit[houseCard]
+		if p not in hit:
+			hit[p] = sum(q * self.optimalValue(p.add(card), houseCard) for card, q in self.draws)
+		return hit[p]
+
+	def optimalValue(self, p, houseCard):
+		optimal = self._optimal[houseCard]
+		if p not in optimal:
+			pay_s = self.standValue(p, houseCard)
+			optimal[p] = max(pay_s, self.hitValue(p, houseCard)) if p.canHit() else pay_s
+		return optimal[p]
+
+	def actionOdds(self, p0, houseCard, starts, exact=False):
+		"""Like OddsCalculator._actionOdds, for hands dealt from NullCardState.
+
+		@param starts: ProbDist([(player hand, p)]) of the hands dealt as p0,
+		    which are more than one if p0 is a single card
+		@param exact: if True, H is hitting then playing hit/stand optimally,
+		    otherwise hitting once then standing, as in the first-order
+		    calculation.
+		"""
+		actions = self.rule.actions
+		# starts may be pruned, e.g. for hard totals; nothing else here is
+		solve = lambda f: starts.expect(lambda p: f(p, houseCard), self.rule.maxPay)
+		odds = {}
+		if "U" in actions:
+			odds["U"] = -0.5
+		if "S" in actions:
+			with timer("odds.S"):
+				odds["S"] = solve(self.standValue)
+		if "H" in actions and p0.canHit():
+			with timer("odds.H"):
+				odds["H"] = solve(self.hitValue if exact else self.hitOnceValue)
+		if "D" in actions and "H" in odds:
+			with timer("odds.D"):
+				odds["D"] = 2 * solve(self.hitOnceValue)
+		return odds
+
+_infiniteDecks = {}
+
+def infiniteDeck(rule):
+	if rule not in _infiniteDecks:
+		_infiniteDecks[rule] = InfiniteDeck(rule)
+	return _infiniteDecks[rule]
+
+
+from bj.house import standPay
+from bj.rule import BJ
+assert all(sum(q for h, q in row) == 1 for row in infiniteDeck(BJ).outcomes.itervalues())
+assert infiniteDeck(BJ).standValue(Hand(0, 17), 6) == standPay(BJ, Hand(0, 17), Hand().add(6), NullCardState())
+assert infiniteDeck(BJ).standValue(Hand(0, 17), None) == standPay(BJ, Hand(0, 17), Hand(), NullCardState())
+assert infiniteDeck(BJ).deal(1, 0).dist == [((Hand().add(1).add(0), NullCardState()), 1)]
+assert len(infiniteDeck(BJ).deal(1).dist) == 10
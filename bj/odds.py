@@ -1,12 +1,24 @@
 import logging
 import math
+import multiprocessing
 import sys
+import time
+import traceback
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+
+import bj.prob
+
+from bj.bankroll import payCovariance
+from bj.cache import LRUCache, registerTable, trimCaches
 from bj.card import NullCardState, TotalCardState, PartialAJHLCardState
 from bj.game import GameState, GameStateDist
 from bj.hand import Hand
+from bj.house import BUST, houseHand, houseOutcome, houseOutcomes, payTable, pinnedOutcomes, standPay
+from bj.infinite import infiniteDeck
+from bj.prob import Bounded, ProbDist, best, errorOf, exact, ratio, valueOf
 from bj.rule import BJS
+from bj.stats import timer
 
 
 class lazyStr(namedtuple("lazyStr", "f")):
@@ -14,6 +26,35 @@ class lazyStr(namedtuple("lazyStr", "f")):
 		return str(self.f())
 
 
+HOUSE_CARDS = [2,3,4,5,6,7,8,9,0,1]
+
+class HardTotal(namedtuple('HardTotal', 'total')):
+	"""Stands in for playerCard0 (with playerCard1 None) to mean any hard
+	(no-A) 2-card hand with this total, see calculateHardOdds."""
+
+	def __str__(self):
+		return "T%d" % self.total
+
+"""Sections of rows (playerCard0, playerCard1) in the strategy table."""
+TABLE = [
+	[(1, i) for i in [0,9,8,7,6,5,4,3,2]],
+	[(0, i) for i in [9,8,7,6,5,4,3,2]] + [(2, i) for i in [9,8,7,6,5,4,3]],
+	[(i, i) for i in [1,0,9,8,7,6,5,4,3,2]],
+]
+
+"""TABLE, with the (0,*) and (2,*) rows replaced by the exact hard totals
+that they approximate."""
+HARD_TABLE = [
+	TABLE[0],
+	[(HardTotal(t), None) for t in xrange(19, 4, -1)],
+	TABLE[2],
+]
+
+def tableRows(hardTotals=False):
+	"""Sections of rows in the strategy table, see TABLE and HARD_TABLE."""
+	return HARD_TABLE if hardTotals else TABLE
+
+
 COLORS = {"H":'\033[42m', "S":'\033[41m', "U":'\033[45m', "D":'\033[46m\033[30m', "P":'\033[43m\033[30m'}
 CEND = '\033[0m'
 def oddsStr(odds):
@@ -30,26 +71,643 @@ def oddsStr(odds):
 		return "%s%s%s" % (COLORS[dodds[0][0]], text, CEND)
 
 
-class OddsCalculator(namedtuple('OddsCalculator', 'initCards rule approx2h')):
+def sortOdds(odds):
+	"""Odds of each action as calculateOdds gives them: best first, exact, and
+	without error bounds.
+
+	@param odds: dict of action to odds, which may be Bounded
+	"""
+	return sorted(((a, exact(valueOf(v))) for a, v in odds.iteritems()), key=lambda p: p[1], reverse=True)
+
+
+class CellOdds(namedtuple('CellOdds', 'cell odds seconds errors payoffs covariance approximate')):
+	"""calculateOdds result for a cell (playerCard0, houseCard, playerCard1),
+	with the wall time it took to get it, with a targetError, the bound on
+	the error of the odds of each action (see calculateOddsBounded), and with
+	payoffs, calculatePayoffs for the cell, the actions whose payoffs are
+	only approximate (P without splitHands, see calculatePayoffs), and for a
+	pair with splitHands, the covariance of the pays of the first two hands
+	of the split (see calculateSplitPays)."""
+
+	def __new__(cls, cell, odds, seconds, errors=None, payoffs=None, covariance=None, approximate=()):
+		return super(CellOdds, cls).__new__(cls, cell, odds, seconds, errors, payoffs, covariance, approximate)
+
+	@property
+	def action(self):
+		return self.odds[0][0]
+
+	@property
+	def margin(self):
+		"""How much better the best action is than the next best one."""
+		return self.odds[0][1] - self.odds[1][1] if len(self.odds) > 1 else None
+
+	@property
+	def error(self):
+		"""Largest bound on the error of any of the odds, or None if unknown."""
+		if self.errors is None:
+			return None
+		return max(self.errors.values() or [0.0])
+
+
+_optimalValues = LRUCache("optimal values")
+
+def dealProbability(initCards, cards):
+	"""Probability of drawing exactly the given cards, in order. None is any
+	card, which doesn't change the probability of the others."""
+	p = ratio(1)
+	for v in cards:
+		if v is None:
+			continue
+		p *= initCards.draw().expect(lambda (card, nextcards): 1 if card == v else 0)
+		if not p:
+			break
+		initCards = initCards.remove(v)
+	return p
+
+def hardCompositions(total):
+	"""Ordered 2-card hands with no A that make the given total.
+
+	@return: list of (playerCard0, playerCard1)
+	"""
+	return [(a % 10, (total - a) % 10) for a in xrange(2, 11) if 2 <= total - a <= 10]
+
+def dealPlayer(initCards, playerCard0, houseCard, playerCard1=None):
+	"""Deal the initial cards, leaving the house's hole card undealt.
+
+	Drawing the hole card after the player is done gives the same distribution
+	as drawing it in turn, but keeps the player's view of the cards independent
+	of it. The same goes for a houseCard of None, which isn't drawn at all, see
+	houseHand.
+
+	@return: ProbDist([((player hand, card state), p)])
+	"""
+	def deal(v, player):
+		return lambda (p, cards): cards.draw(v).map(lambda (card, nextcards): (p.add(card) if player else p, nextcards))
+	d = ProbDist.inject((Hand(), initCards)).bind(deal(playerCard0, True))
+	if houseCard is not None:
+		d = d.bind(deal(houseCard, False))
+	return d.bind(deal(playerCard1, True))
+
+def standValue(rule, p, cards, h):
+	"""Expected pay for standing on p, against house hand h."""
+	return standPay(rule, p, h, cards)
+
+def hitOnceValue(rule, p, cards, h):
+	"""Expected pay for hitting p exactly once, then standing."""
+	if not p.canHit():
+		return standValue(rule, p, cards, h)
+	return cards.draw().expect(lambda (card, nextcards): standValue(rule, p.add(card), nextcards, h))
+
+def hitValue(rule, p, cards, h):
+	"""Expected pay for hitting p, then playing hit/stand optimally."""
+	if not p.canHit():
+		return standValue(rule, p, cards, h)
+	return cards.draw().expect(lambda (card, nextcards): optimalValue(rule, p.add(card), nextcards, h))
+
+def winBound(rule):
+	"""Most that a hand of 3+ cards (or a split hand) can be paid: a win
+	against a bust house."""
+	return payTable(rule).pay(BUST, Hand(0, 21))
+
+def hitBound(rule, p, cards):
+	"""Cheap upper bound on the expected pay for hitting p.
+
+	Busting loses outright, and no hand of 3+ cards is paid more than
+	winBound. Which cards bust p only depends on its hard total (counting
+	any ace as 1).
+	"""
+	hard = p.osum + p.ace
+	win, lose = winBound(rule), payTable(rule).pay(BUST, Hand(0, 23))
+	return cards.draw().expect(lambda (card, nextcards): lose if hard + (card or 10) > 21 else win)
+
+def optimalValue(rule, p, cards, h):
+	"""Expected pay for p when playing hit/stand optimally.
+
+	Memoised on all of its arguments (and PROB_EVENT_TOLERANCE), so
+	subresults are shared between every initial hand that can reach the same
+	(hand, card state) pair. Nearly all of the cost is playing out the house
+	(see houseOutcomes) from every card state the player can stand on, so it
+	grows with the number of distinct card states, and is more than approx2h,
+	which only looks two hits ahead.
+	"""
+	if p.isBust():
+		# nothing to decide, so don't take up a cache entry with it
+		return standValue(rule, p, cards, h)
+	def solve():
+		pay_s = standValue(rule, p, cards, h)
+		# skip the whole subtree if hitting can't possibly do better
+		if not p.canHit() or pay_s >= hitBound(rule, p, cards):
+			return pay_s
+		return best(pay_s, hitValue(rule, p, cards, h))
+	return _optimalValues.get((rule, p, cards, h, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+_optimalPayoffs = LRUCache("optimal payoffs")
+
+def standPayoff(rule, p, cards, h):
+	"""Distribution of the pay for standing on p, against house hand h.
+
+	The payoff functions mirror the value functions (standValue etc.), taking
+	the same decisions, so the expectation of each is the corresponding value.
+
+	@return: ProbDist([(pay, p)])
+	"""
+	pay = payTable(rule).pay
+	if p.isBust():
+		return ProbDist.inject(pay(BUST, p))
+	return houseOutcomes(rule, h, cards).map(lambda o: pay(o, p))
+
+def hitOncePayoff(rule, p, cards, h):
+	"""Distribution of the pay for hitting p exactly once, then standing."""
+	if not p.canHit():
+		return standPayoff(rule, p, cards, h)
+	return cards.draw().bind(lambda (card, nextcards): standPayoff(rule, p.add(card), nextcards, h))
+
+def hitPayoff(rule, p, cards, h):
+	"""Distribution of the pay for hitting p, then playing hit/stand optimally."""
+	if not p.canHit():
+		return standPayoff(rule, p, cards, h)
+	return cards.draw().bind(lambda (card, nextcards): optimalPayoff(rule, p.add(card), nextcards, h))
+
+def optimalPayoff(rule, p, cards, h):
+	"""Distribution of the pay for p when playing hit/stand optimally, as
+	decided by optimalValue."""
+	def solve():
+		if not p.canHit() or optimalValue(rule, p, cards, h) <= standValue(rule, p, cards, h):
+			return standPayoff(rule, p, cards, h)
+		return hitPayoff(rule, p, cards, h)
+	return _optimalPayoffs.get((rule, p, cards, h, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+def splitHand(c, x):
+	"""Hand of a split card c and the card x dealt to it, which is never a
+	natural."""
+	p = Hand().add(c).add(x)
+	return Hand(p.ace, p.osum)
+
+_splitValues = LRUCache("split values")
+
+def splitValue(rule, c, h, cards, maxHands, p=None, pending=2, hands=2):
+	"""Expected total pay for splitting a pair of c against house hand h, then
+	playing every hand optimally.
+
+	The hands are played one after another from the same cards, and each
+	hit/stand and resplit decision is the best one for the hand being played
+	and the ones after it, knowing every card drawn so far. A hand that is
+	dealt another c may be split again, up to maxHands hands in all. Split
+	aces get one card each, and there is no doubling after splitting.
+
+	The house only draws once every hand is done, but none of the player's
+	decisions can depend on what it draws, so each hand is paid the same on
+	average as if the house drew straight after it (see standPay). Finished
+	hands can then be left out of the state, and the last hand is just
+	optimalValue. The rest is memoised on the hand being played, the card
+	state and the hands still to come, counting the resplits left rather than
+	maxHands and hands, so every hand of the split (and every limit) shares
+	the values of playing out the same hands from the same cards.
+
+	@param p: hand being played, or None to deal the next one
+	@param pending: number of hands still holding just c
+	@param hands: number of hands so far
+	"""
+	if p is not None and not pending:
+		return optimalValue(rule, p, cards, h)
+	def solve():
+		if p is not None:
+			pay_s = standPay(rule, p, h, cards) + splitValue(rule, c, h, cards, maxHands, None, pending, hands)
+			# prune as in optimalValue, allowing that whatever cards hitting
+			# leaves, each hand still to come (resplits included) might win
+			if not p.canHit() or pay_s >= hitBound(rule, p, cards) + (pending + maxHands - hands) * winBound(rule):
+				return pay_s
+			return best(pay_s, cards.draw().expect(lambda (card, nextcards):
+				splitValue(rule, c, h, nextcards, maxHands, p.add(card), pending, hands)))
+		if not pending:
+			return 0
+		def deal((card, nextcards)):
+			q = splitHand(c, card)
+			if c == 1:
+				# split aces can't be hit
+				pay = standPay(rule, q, h, nextcards) + splitValue(rule, c, h, nextcards, maxHands, None, pending - 1, hands)
+			else:
+				pay = splitValue(rule, c, h, nextcards, maxHands, q, pending - 1, hands)
+			if card == c and hands < maxHands:
+				# put it back with the pending ones, along with the new hand
+				pay = best(pay, splitValue(rule, c, h, nextcards, maxHands, None, pending + 1, hands + 1))
+			return pay
+		return cards.draw().expect(deal)
+	return _splitValues.get((rule, c, h, cards, p, pending, maxHands - hands, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+_playedHands = LRUCache("played hands")
+
+def playedHands(rule, p, cards, h):
+	"""Distribution of how p ends up when playing hit/stand optimally, as
+	decided by optimalValue: the finished hand, reduced by houseOutcome since
+	that pays the same, and the cards left.
+
+	@return: ProbDist([((finished hand, card state), p)])
+	"""
+	def solve():
+		if not p.canHit() or optimalValue(rule, p, cards, h) <= standValue(rule, p, cards, h):
+			return ProbDist.inject((houseOutcome(p), cards))
+		return cards.draw().bind(lambda (card, nextcards): playedHands(rule, p.add(card), nextcards, h))
+	return _playedHands.get((rule, p, cards, h, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+_splitFinals = LRUCache("split finals")
+
+def splitFinals(rule, c, h, cards, maxHands, p=None, pending=2, hands=2):
+	"""Distribution of how the hands of a split of c end up, taking the
+	decisions splitValue does: the finished hands, reduced as in playedHands
+	and in the order they were played, and the cards left once they are all
+	done. Arguments are as for splitValue, and only the hands finished from
+	there on are given.
+
+	@return: ProbDist([((finished hands), card state)])
+	"""
+	if p is not None and not pending:
+		return playedHands(rule, p, cards, h).map(lambda (q, cards): ((q,), cards))
+	value = lambda cards, p, pending, hands: splitValue(rule, c, h, cards, maxHands, p, pending, hands)
+	finals = lambda cards, p, pending, hands: splitFinals(rule, c, h, cards, maxHands, p, pending, hands)
+	# q was finished before the hands in d
+	then = lambda q, d: d.map(lambda (qs, cards): ((houseOutcome(q),) + qs, cards))
+	def solve():
+		if p is not None:
+			if not p.canHit() or value(cards, p, pending, hands) <= \
+					standPay(rule, p, h, cards) + value(cards, None, pending, hands):
+				return then(p, finals(cards, None, pending, hands))
+			return cards.draw().bind(lambda (card, nextcards): finals(nextcards, p.add(card), pending, hands))
+		if not pending:
+			return ProbDist.inject(((), cards))
+		def deal((card, nextcards)):
+			q = splitHand(c, card)
+			if c == 1:
+				# split aces can't be hit
+				stay = standPay(rule, q, h, nextcards) + value(nextcards, None, pending - 1, hands)
+			else:
+				stay = value(nextcards, q, pending - 1, hands)
+			if card == c and hands < maxHands and value(nextcards, None, pending + 1, hands + 1) > stay:
+				return finals(nextcards, None, pending + 1, hands + 1)
+			if c == 1:
+				return then(q, finals(nextcards, None, pending - 1, hands))
+			return finals(nextcards, q, pending - 1, hands)
+		return cards.draw().bind(deal)
+	return _splitFinals.get((rule, c, h, cards, p, pending, maxHands - hands, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+_splitPays = LRUCache("split pays")
+
+def splitPays(rule, c, h, cards, maxHands):
+	"""Joint distribution of the pay of each hand for splitting a pair of c
+	against house hand h, taking the decisions splitValue does.
+
+	The house plays once, from the cards left after every hand is done (see
+	splitFinals), and each hand is paid against that same house hand. So
+	unlike the pays splitValue adds up, which are each against a house that
+	drew straight after that hand, these are the real joint pays, with the
+	same expectations.
+
+	@return: ProbDist([((pay of each hand in the order played), p)])
+	"""
+	def solve():
+		pay = payTable(rule).pay
+		return splitFinals(rule, c, h, cards, maxHands).bind(lambda (qs, cards):
+			houseOutcomes(rule, h, cards).map(lambda o: tuple(pay(o, q) for q in qs)))
+	return _splitPays.get((rule, c, h, cards, maxHands, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+def splitPayoff(rule, c, h, cards, maxHands):
+	"""Distribution of the total pay for splitting a pair of c against house
+	hand h, see splitPays. Its expectation is splitValue.
+
+	@return: ProbDist([(pay, p)])
+	"""
+	return splitPays(rule, c, h, cards, maxHands).map(sum)
+
+
+"""Don't prune with tolerances smaller than this in calculateOddsBounded;
+calculate exactly instead, which is hardly any more expensive by then."""
+MIN_EVENT_TOLERANCE = 1e-9
+
+# (tolerance to start calculateOddsBounded from, smallest tolerance that was
+# too loose) by calculator, target and house card, from the cells before in the
+# same column
+_tolerances = registerTable({})
+
+class OddsCalculator(namedtuple('OddsCalculator', 'initCards rule approx2h exact store splitHands targetError payoffs')):
+	"""
+	@param store: OddsStore to look up results in before calculating them, and
+	    to save them to afterwards. None to always calculate them.
+	@param splitHands: in exact mode, calculate splitting exactly with
+	    splitValue, allowing up to this many hands from resplitting. If None,
+	    splitting is approximated as twice the best odds for holding one of
+	    the cards, which is much cheaper for deep card states but ignores
+	    resplits, the cards the other hand removes, and seeing the second
+	    card before choosing how to play.
+	@param targetError: calculate every cell with calculateOddsBounded, to
+	    within this of the unpruned odds, instead of with the fixed
+	    PROB_EVENT_TOLERANCE. The store is not used, since each cell is
+	    calculated with whatever tolerance it needed.
+	@param payoffs: also calculate the distribution of the pay of each
+	    action for every cell in calculateCells, see calculatePayoffs. Not
+	    with approx2h, nor with targetError, since nothing is pruned from
+	    them.
+	"""
+
+	def __new__(cls, initCards, rule, approx2h=False, exact=False, store=None, splitHands=None, targetError=None,
+			payoffs=False):
+		if approx2h and exact: raise ValueError
+		if splitHands is not None and (splitHands < 2 or not exact): raise ValueError
+		if targetError is not None and targetError <= 0: raise ValueError
+		if payoffs and (approx2h or targetError is not None): raise ValueError
+		return super(OddsCalculator, cls).__new__(cls, initCards, rule, approx2h, exact, store, splitHands, targetError,
+			payoffs)
+
+	@property
+	def infinite(self):
+		"""Whether odds are calculated with InfiniteDeck, which deals like
+		exact mode does whether or not we are in it."""
+		return self.initCards.__class__ is NullCardState and not self.approx2h
 
 	def expectHousePay(self, h0, gsd):
+		rule = self.rule
 		logging.debug("-------- house initial hand vs player hands\n%s",
 			lazyStr(lambda: gsd.map(lambda gs: gs.replaceDecks(NullCardState()).replaceHand(0, h0)).map(str)))
-		gsd = gsd.map(GameState.turnDoneNext).execRound([self.rule.playHouse], 0)
-		logging.debug("-------- house hand vs player end results\n%s",
-			lazyStr(lambda: gsd.map(lambda gs: gs.replaceDecks(NullCardState()).describeHands()).map(str)))
-		return gsd.expectPay(self.rule.pay)
+		# the house plays the same way whatever the players hold, so look up
+		# its outcomes per (house hand, card state) rather than playing it out
+		# for every player state
+		pay = lambda gs, i: standPay(rule, gs.hands[i], gs.hands[0], gs.cards)
+		if not gsd.dist:
+			# everything was pruned, see PROB_EVENT_TOLERANCE; we only ever
+			# deal one player here
+			return [0, Bounded(0, gsd.pruned * rule.maxPay)]
+		logging.debug("-------- house hand vs player expected pay\n%s",
+			lazyStr(lambda: gsd.map(lambda gs: "%s %+.4f" % (gs.replaceDecks(NullCardState()), pay(gs, 1))).map(str)))
+		return [0] + [gsd.expect(lambda gs: pay(gs, i), rule.maxPay) for i in xrange(1, gsd.numPlayers())]
+
+	def calculateOdds(self, playerCard0, houseCard, playerCard1=None, splits=None):
+		"""
+		@param splits: dict of playerCard0 to the odds of holding just that
+		    card against houseCard, used and filled in for working out the odds
+		    of splitting. Pass the same one to calls with the same houseCard to
+		    only calculate those once.
+		"""
+		if self.targetError is not None:
+			return self.calculateOddsBounded(playerCard0, houseCard, playerCard1, splits)[0]
+		cell = (playerCard0, houseCard, playerCard1)
+		return self._stored(cell, lambda: sortOdds(self._calculateOdds(cell, splits)))
+
+	def calculateOddsBounded(self, playerCard0, houseCard, playerCard1=None, splits=None, target=None):
+		"""Like calculateOdds, pruning as much as possible while keeping every
+		odds within target of the unpruned odds.
+
+		Every value calculated from pruned distributions carries a bound on
+		its error, from the probability that was pruned (see Bounded), so we
+		can tell whether a tolerance was good enough rather than guess. We
+		start from the tolerance that was good enough for the last cell in the
+		same column, and tighten it tenfold until the bound is within target,
+		calculating exactly if it gets below MIN_EVENT_TOLERANCE. If the bound
+		was well within target, the next cell starts from a looser tolerance,
+		unless that was already too loose for an earlier cell.
+
+		@param splits: as in calculateOdds, but a dict of them by tolerance
+		@param target: bound on the error, default self.targetError
+		@return: (odds, errors, tolerance) where odds is as in calculateOdds,
+		    errors is a dict of action to the bound on the error of its odds,
+		    and tolerance is the PROB_EVENT_TOLERANCE that was used
+		"""
+		target = self.targetError if target is None else target
+		if splits is None:
+			splits = {}
+		cell = (playerCard0, houseCard, playerCard1)
+		key = (self._replace(store=None), target, houseCard)
+		tolerance, tooLoose = _tolerances.get(key, (target, None))
+		saved = bj.prob.PROB_EVENT_TOLERANCE
+		try:
+			while True:
+				bj.prob.PROB_EVENT_TOLERANCE = tolerance
+				odds = self._calculateOdds(cell, splits.setdefault(tolerance, {}))
+				errors = dict((a, float(errorOf(v))) for a, v in odds.iteritems())
+				error = max(errors.values() or [0.0])
+				if error <= target or not tolerance:
+					break
+				tooLoose = tolerance if tooLoose is None else min(tooLoose, tolerance)
+				tolerance = tolerance / 10 if tolerance / 10 >= MIN_EVENT_TOLERANCE else 0
+		finally:
+			bj.prob.PROB_EVENT_TOLERANCE = saved
+		looser = max(tolerance, MIN_EVENT_TOLERANCE) * 10
+		if error < target / 10 and (tooLoose is None or looser < tooLoose):
+			_tolerances[key] = (looser, tooLoose)
+		else:
+			_tolerances[key] = (tolerance, tooLoose)
+		return sortOdds(odds), errors, tolerance
+
+	def calculateHardOdds(self, total, houseCard):
+		"""Like calculateOdds, for any hard (no-A) 2-card hand with the given
+		total.
+
+		The odds of each action are averaged over every composition of the
+		total, weighted by how likely it is to be dealt against houseCard, so
+		they are exact rather than approximated by one (0,*) or (2,*) cell.
+		Splitting is left out, since it is only possible for some of them.
+
+		Only the total of the player's hand matters after the deal, so it is
+		reduced to that before anything is calculated: compositions that then
+		leave the same hand and card state (all of them for NullCardState,
+		ones whose cards are in the same class for PartialAJHLCardState) are
+		merged into one event, and the rest share subresults through the
+		usual caches.
+		"""
+		return self.calculateOdds(HardTotal(total), houseCard)
+
+	def calculatePayoffs(self, playerCard0, houseCard, playerCard1=None, splits=None):
+		"""Distribution of the pay of each action for a cell, e.g. for sizing
+		bets (see bj.bankroll).
+
+		Each action is played as in calculateOdds, so the expectation of its
+		distribution is its odds (see payoffOdds). P is taken as both hands
+		coming out the same as one hand holding playerCard0 played with its
+		best action, which has the same expectation as the approximation
+		calculateOdds makes but overstates the spread. With splitHands it is
+		the sum of calculateSplitPays, which is exact. Not available with
+		approx2h.
+
+		@param splits: dict of playerCard0 to the payoffs of holding just that
+		    card against houseCard, like the splits of calculateOdds
+		@return: dict of action to ProbDist([(pay, p)])
+		"""
+		if self.approx2h:
+			raise ValueError("payoffs are not available with approx2h")
+		if isinstance(playerCard0, HardTotal):
+			p0, dealt = self._dealHard(playerCard0.total, houseCard)
+		else:
+			p0 = Hand().add(playerCard0).add(playerCard1)
+			with timer("dealNewRound"):
+				dealt = self._deal((playerCard0, houseCard, playerCard1))
+		payoffs = self._actionPayoffs(p0, houseCard, dealt)
+		if "P" in self.rule.actions and playerCard0 == playerCard1 and self.splitHands:
+			with timer("odds.P"):
+				payoffs["P"] = self.calculateSplitPays(playerCard0, houseCard).map(sum)
+		elif "P" in self.rule.actions and playerCard0 == playerCard1:
+			if splits is None:
+				splits = {}
+			if playerCard0 not in splits:
+				splits[playerCard0] = self.calculatePayoffs(playerCard0, houseCard)
+			action = sortOdds(self.payoffOdds(splits[playerCard0]))[0][0]
+			payoffs["P"] = splits[playerCard0][action].map(lambda x: 2 * x)
+		return payoffs
+
+	def calculateSplitPays(self, playerCard0, houseCard):
+		"""Joint distribution of the pay of each hand for splitting a pair of
+		playerCard0 against houseCard, see splitPays. Only with splitHands.
+
+		@return: ProbDist([((pay of each hand in the order played), p)])
+		"""
+		if not self.splitHands:
+			raise ValueError("split pays are only available with splitHands")
+		h0 = houseHand(houseCard)
+		with timer("dealNewRound"):
+			dealt = self._deal((playerCard0, houseCard, playerCard0))
+		return dealt.bind(lambda (p, cards): splitPays(self.rule, playerCard0, h0, cards, self.splitHands))
+
+	def payoffOdds(self, payoffs):
+		"""Odds of each action from its calculatePayoffs distribution.
+
+		@return: dict of action to odds, which are Bounded if anything was
+		    pruned, as in _calculateOdds
+		"""
+		hands = {"D": 2, "P": self.splitHands or 2}
+		return dict((a, d.expect(lambda x: x, self.rule.maxPay * hands.get(a, 1))) for a, d in payoffs.iteritems())
+
+	def _stored(self, cell, calculate):
+		if self.store is None or self.targetError is not None:
+			return calculate()
+		odds = self.store.get(self, cell)
+		if odds is None:
+			odds = calculate()
+			self.store.put(self, cell, odds)
+		return odds
+
+	def calculateOddsBatch(self, hands, upcards):
+		"""Calculate odds for each of the given hands against each upcard.
+
+		Upcards are done one at a time. The house's outcomes from each card
+		state that the hands can leave are played out once for the upcard and
+		every hand is scored from them (see pinnedOutcomes), however small
+		the caches are; the odds for splitting are calculated once per card
+		rather than once per pair.
+
+		@param hands: list of (playerCard0, playerCard1)
+		@param upcards: list of houseCard
+		@return: list of CellOdds, one for each (hand, upcard), with the hands
+		    in the order given and each hand's upcards in order, i.e. the
+		    CellOdds for hands[i] against upcards[j] is at
+		    i * len(upcards) + j
+		"""
+		results = [None] * (len(hands) * len(upcards))
+		for j, houseCard in enumerate(upcards):
+			splits = {}
+			with pinnedOutcomes():
+				for i, (playerCard0, playerCard1) in enumerate(hands):
+					results[i * len(upcards) + j] = self._timedOdds((playerCard0, houseCard, playerCard1), splits)
+			trimCaches()
+		return results
+
+	def _deal(self, (playerCard0, houseCard, playerCard1)):
+		"""
+		@return: in exact mode or with InfiniteDeck, dealPlayer's
+		    ProbDist([((player hand, card state), p)]), otherwise a
+		    GameStateDist of the same, up to the player's turn
+		"""
+		if self.infinite:
+			return infiniteDeck(self.rule).deal(playerCard0, playerCard1)
+		dealt = dealPlayer(self.initCards, playerCard0, houseCard, playerCard1)
+		if self.exact:
+			return dealt
+		# the house's hole card is left undealt here too, so the house plays
+		# from its up card and the cards left, which are the same trees as
+		# for a card state with one more card removed, e.g. in a sweep
+		h0 = houseHand(houseCard)
+		return GameStateDist([(GameState(cards, [h0, p]), q) for (p, cards), q in dealt.dist], dealt.pruned)
+
+	def _calculateOdds(self, (playerCard0, houseCard, playerCard1), splits=None):
+		"""
+		@return: dict of action to odds, which are Bounded if anything was
+		    pruned
+		"""
+		if isinstance(playerCard0, HardTotal):
+			return self._calculateHardOdds(playerCard0.total, houseCard)
+		# the same phase as GameStateDist.dealNewRound, which we don't use
+		with timer("dealNewRound"):
+			dealt = self._deal((playerCard0, houseCard, playerCard1))
+		odds = self._actionOdds(Hand().add(playerCard0).add(playerCard1), houseCard, dealt)
 
-	def calculateOdds(self, playerCard0, houseCard, playerCard1=None):
+		if "P" in self.rule.actions and playerCard0 == playerCard1 and self.splitHands:
+			with timer("odds.P"):
+				h0 = houseHand(houseCard)
+				odds["P"] = dealt.expect(lambda (p, cards): splitValue(self.rule, playerCard0, h0, cards, self.splitHands),
+					self.rule.maxPay * self.splitHands)
+		elif "P" in self.rule.actions and playerCard0 == playerCard1:
+			with timer("odds.P"):
+				if splits is None:
+					splits = {}
+				if playerCard0 not in splits:
+					splits[playerCard0] = self._splitOdds(playerCard0, houseCard)
+				odds["P"] = 2 * best(*splits[playerCard0].values())
+
+		return odds
+
+	def _splitOdds(self, playerCard0, houseCard):
+		"""Odds of holding just playerCard0 against houseCard, as a dict."""
+		if bj.prob.PROB_EVENT_TOLERANCE or self.targetError is not None:
+			# the store and calculateOdds drop the error bounds
+			return self._calculateOdds((playerCard0, houseCard, None))
+		return dict(self.calculateOdds(playerCard0, houseCard))
+
+	def _calculateHardOdds(self, total, houseCard):
+		p0, dealt = self._dealHard(total, houseCard)
+		return self._actionOdds(p0, houseCard, dealt)
+
+	def _dealHard(self, total, houseCard):
+		"""
+		@return: (player hand, dealt): the hand of the given total, and _deal's
+		    distribution over every composition of it
+		"""
+		with timer("dealNewRound"):
+			comps = [((a, b), dealProbability(self.initCards, [a, houseCard, b])) for a, b in hardCompositions(total)]
+			t = sum(p for c, p in comps)
+			if not t:
+				raise ValueError("no hard 2-card hand totals %s" % total)
+			comps = [(c, p / t) for c, p in comps if p]
+			p0 = Hand(0, total)
+			if self.exact or self.infinite:
+				dealt = ProbDist(comps).bind(self._dealHand(houseCard)).map(lambda (p, cards): (p0, cards))
+			else:
+				dealt = GameStateDist(comps).bind(self._dealHand(houseCard)).map(lambda gs: gs.replaceHand(1, p0))
+		return p0, dealt
+
+	def _dealHand(self, houseCard):
+		return lambda (playerCard0, playerCard1): self._deal((playerCard0, houseCard, playerCard1))
+
+	def _actionOdds(self, p0, houseCard, dealt):
+		"""Odds of each action apart from P, for the player hand p0 as dealt.
+
+		@param dealt: see _deal
+		@return: dict of action to odds
+		"""
 		initCards = self.initCards
 		rule = self.rule
 
-		gsd0 = GameStateDist.initGame(2, initCards)
-		gsd0 = gsd0.dealNewRound(cards=[playerCard0, houseCard, playerCard1])
-		p0 = Hand().add(playerCard0).add(playerCard1)
-		h0 = Hand().add(houseCard)
-		logging.debug("-------- initial hands\nCards=%s\nPlayer=%s House=%s\n%s",
-			initCards, repr(p0), repr(h0), lazyStr(lambda: gsd0.map(str)))
+		# every decision that depends on how the hand was dealt is made by now,
+		# so merge the hands (and states) that only differ in that
+		if self.infinite:
+			# the card state never changes, so only the player's hands matter
+			return infiniteDeck(rule).actionOdds(p0, houseCard, dealt.map(lambda (p, cards): p.canonical()), self.exact)
+
+		h0 = houseHand(houseCard)
+		if self.exact:
+			starts = dealt.map(lambda (p, cards): (p.canonical(), cards))
+			solve = lambda f: starts.expect(lambda (p, cards): f(rule, p, cards, h0), rule.maxPay)
+			logging.debug("-------- initial hands\nCards=%s\nPlayer=%s House=%s\n%s",
+				initCards, repr(p0), repr(h0), lazyStr(lambda: starts.map(lambda (p, cards): "%s %s" % (p, cards))))
+		else:
+			gsd0 = dealt.map(GameState.canonical)
+			logging.debug("-------- initial hands\nCards=%s\nPlayer=%s House=%s\n%s",
+				initCards, repr(p0), repr(h0), lazyStr(lambda: gsd0.map(str)))
 
 		payout = lambda gsd: self.expectHousePay(h0, gsd)
 		odds = {}
@@ -58,53 +716,206 @@ class OddsCalculator(namedtuple('OddsCalculator', 'initCards rule approx2h')):
 			odds["U"] = -0.5
 
 		if "S" in rule.actions:
-			pay_s = payout(gsd0)[1]
-			odds["S"] = pay_s
+			with timer("odds.S"):
+				pay_s = solve(standValue) if self.exact else payout(gsd0)[1]
+				odds["S"] = pay_s
 
 		if "H" in rule.actions and p0.canHit():
-			gsd_h = gsd0.bind(GameState.hit)
-			pay_hs = payout(gsd_h)[1]
-
-			if self.approx2h:
-				# second-order approximation for H, slightly more accurate but much more expensive
-				# hit, must stick
-				p_hn, gsd_hn = gsd_h.given(lambda gs: not gs.currentHand().canHit())
-				# hit, option to hit again
-				p_ho, gsd_ho = gsd_h.given(lambda gs: gs.currentHand().canHit())
-				pay_hns = payout(gsd_hn)[1] if p_hn else 0.0
-				pay_hos, pay_hohs = (payout(gsd_ho)[1], payout(gsd_ho.bind(GameState.hit))[1]) if p_ho else (0.0, 0.0)
-
-				# Pay(hit) ~= Pay(hit1|couldnt_hit)*P(couldnt_hit) + max(Pay(hit2|could_hit),Pay(hit2|could_hit))*P(could_hit)
-				pay_h = pay_hns * p_hn + max(pay_hos, pay_hohs) * p_ho
-			else:
-				pay_h = pay_hs
+			with timer("odds.H"):
+				if self.exact:
+					# exact optimal hit/stand play, see optimalValue
+					pay_h = solve(hitValue)
+				else:
+					gsd_h = gsd0.bind(GameState.hit)
+					pay_hs = payout(gsd_h)[1]
+
+				if self.approx2h:
+					# second-order approximation for H, slightly more accurate but much more expensive
+					# hit, must stick
+					p_hn, gsd_hn = gsd_h.given(lambda gs: not gs.currentHand().canHit())
+					# hit, option to hit again
+					p_ho, gsd_ho = gsd_h.given(lambda gs: gs.currentHand().canHit())
+					pay_hns = payout(gsd_hn)[1] if p_hn else 0.0
+					pay_hos, pay_hohs = (payout(gsd_ho)[1], payout(gsd_ho.bind(GameState.hit))[1]) if p_ho else (0.0, 0.0)
 
-			odds["H"] = pay_h
+					# Pay(hit) ~= Pay(hit1|couldnt_hit)*P(couldnt_hit) + max(Pay(hit2|could_hit),Pay(hit2|could_hit))*P(could_hit)
+					pay_h = pay_hns * p_hn + best(pay_hos, pay_hohs) * p_ho
+					if gsd_h.pruned:
+						# given leaves the pruned events out of both parts
+						pay_h = Bounded(0, gsd_h.pruned * rule.maxPay) + pay_h
+				elif not self.exact:
+					pay_h = pay_hs
+
+				odds["H"] = pay_h
 
 		if "D" in rule.actions and "H" in odds:
-			odds["D"] = 2 * odds["H"]
+			with timer("odds.D"):
+				odds["D"] = 2 * (solve(hitOnceValue) if self.exact else odds["H"])
+
+		return odds
+
+	def _actionPayoffs(self, p0, houseCard, dealt):
+		"""Payoffs of each action apart from P, like _actionOdds.
 
-		if "P" in rule.actions and playerCard0 == playerCard1:
-			splitodds = self.calculateOdds(playerCard0, houseCard)
-			odds["P"] = 2 * splitodds[0][1]
+		@return: dict of action to ProbDist([(pay, p)])
+		"""
+		rule = self.rule
+		h0 = houseHand(houseCard)
+		if self.exact or self.infinite:
+			starts = dealt.map(lambda (p, cards): (p.canonical(), cards))
+			solve = lambda f: starts.bind(lambda (p, cards): f(rule, p, cards, h0))
+			pay_s = lambda: solve(standPayoff)
+			pay_h = lambda: solve(hitPayoff if self.exact else hitOncePayoff)
+			pay_d = lambda: solve(hitOncePayoff)
+		else:
+			# the house's hole card isn't dealt yet, see _deal
+			stand = lambda gsd: gsd.bind(lambda gs: standPayoff(rule, gs.hands[1], gs.cards, gs.hands[0]))
+			gsd0 = dealt.map(GameState.canonical)
+			pay_s = lambda: stand(gsd0)
+			pay_h = pay_d = lambda: stand(gsd0.bind(GameState.hit))
+
+		payoffs = {}
+		if "U" in rule.actions:
+			payoffs["U"] = ProbDist.inject(-0.5)
+		if "S" in rule.actions:
+			payoffs["S"] = pay_s()
+		if "H" in rule.actions and p0.canHit():
+			payoffs["H"] = pay_h()
+		if "D" in rule.actions and "H" in payoffs:
+			payoffs["D"] = pay_d().map(lambda x: 2 * x)
+		return payoffs
+
+	def calculateTable(self, rows, jobs=1):
+		"""Calculate odds for every house card against each of the given rows.
+
+		@param rows: list of (playerCard0, playerCard1)
+		@param jobs: number of worker processes to spread the cells over
+		@return: iterator of calculateOdds results, one for each (row, house
+		    card) in row-major order. Results are yielded as soon as they and
+		    all the ones before them are available.
+		"""
+		cells = [(h0, i, h1) for h0, h1 in rows for i in HOUSE_CARDS]
+		return (c.odds for c in self.calculateCells(cells, jobs))
 
-		return sorted(odds.items(), key=lambda p: p[1], reverse=True)
+	def calculateCells(self, cells, jobs=1, ordered=True):
+		"""Calculate odds for each of the given cells.
 
-	def printRow(self, h0, h1, fp=sys.stdout):
-		print >>fp, Hand.cardsToStr(h0, h1),
+		@param cells: list of (playerCard0, houseCard, playerCard1)
+		@param jobs: number of worker processes to spread the cells over
+		@param ordered: yield results in the order of cells. Otherwise they are
+		    yielded as soon as each one is available.
+		@return: iterator of CellOdds
+		"""
+		if jobs <= 1:
+			return _calculateSerial(self, cells)
+		return self._calculateParallel(cells, jobs, ordered)
+
+	def _timedOdds(self, cell, splits):
+		start = time.time()
+		errors = payoffs = covariance = None
+		approximate = ()
+		if self.payoffs:
+			# the odds are just the expectations of the payoffs, so don't play
+			# everything out again for them
+			payoffs = self.calculatePayoffs(*cell, splits=splits)
+			odds = sortOdds(self.payoffOdds(payoffs))
+			if "P" in payoffs and self.splitHands:
+				# splitPays is memoised, so this is just the sums over again
+				covariance = payCovariance(self.calculateSplitPays(cell[0], cell[1]))
+			elif "P" in payoffs:
+				approximate = ("P",)
+		elif self.targetError is not None:
+			odds, errors, tolerance = self.calculateOddsBounded(*cell, splits=splits)
+		else:
+			odds = self.calculateOdds(*cell, splits=splits)
+		return CellOdds(cell, odds, time.time() - start, errors, payoffs, covariance, approximate)
+
+	def _calculateParallel(self, cells, jobs, ordered):
+		# serve whatever we already have from the store, and only hand the rest
+		# out to workers
+		results = {}
+		if self.store is not None and self.targetError is None and not self.payoffs:
+			for n, cell in enumerate(cells):
+				odds = self.store.get(self, cell)
+				if odds is not None:
+					results[n] = CellOdds(cell, odds, 0.0)
+		# Our caches are all keyed on the house hand, so give each worker whole
+		# columns (or, if there are more than 10 workers, every mth row of a
+		# column) and let it reuse its own warm caches. Workers are forked from
+		# this process so they also start off with everything cached here.
+		work = [[] for j in xrange(jobs)]
+		for n, cell in enumerate(cells):
+			if n in results: continue
+			r, c = divmod(n, len(HOUSE_CARDS))
+			m = max(1, len(xrange(c, jobs, len(HOUSE_CARDS))))
+			work[(c + len(HOUSE_CARDS) * (r % m)) % jobs].append((n, cell))
+		queue = multiprocessing.Queue()
+		procs = [multiprocessing.Process(target=_tableWorker, args=(self, w, queue)) for w in work if w]
+		for proc in procs:
+			proc.start()
+		def get():
+			k, result = queue.get()
+			if k is None:
+				raise RuntimeError("table worker failed:\n%s" % result)
+			return k, result
+		try:
+			if ordered:
+				for n in xrange(len(cells)):
+					while n not in results:
+						k, result = get()
+						results[k] = result
+					yield results.pop(n)
+			else:
+				for n in sorted(results):
+					yield results[n]
+				for n in xrange(len(cells) - len(results)):
+					yield get()[1]
+		finally:
+			for proc in procs:
+				proc.terminate()
+				proc.join()
+
+	def printRow(self, h0, h1, fp=sys.stdout, odds=None):
+		"""
+		@param odds: iterator of precalculated odds for each house card, e.g.
+		    from calculateTable. If omitted, we calculate them here.
+		"""
+		if odds is None:
+			odds = self.calculateTable([(h0, h1)])
+		print >>fp, "%2d" % h0.total if isinstance(h0, HardTotal) else Hand.cardsToStr(h0, h1),
 		fp.flush()
-		for i in [2,3,4,5,6,7,8,9,0,1]:
-			print >>fp, '|', oddsStr(self.calculateOdds(h0, i, h1)),
+		for i in HOUSE_CARDS:
+			print >>fp, '|', oddsStr(next(odds)),
 			fp.flush()
 		print >>fp
 
-	def printTable(self, fp=sys.stdout):
-		divider = "---+-" + "-+-".join("-"*13 for i in [2,3,4,5,6,7,8,9,0,1])
-		print >>fp, "P\H|", " | ".join(Hand.cardsToStr(i).rjust(13, " ") for i in [2,3,4,5,6,7,8,9,0,1])
-		print >>fp, divider
-		for i in [0,9,8,7,6,5,4,3,2]: self.printRow(1, i, fp)
-		print >>fp, divider
-		for i in [9,8,7,6,5,4,3,2]: self.printRow(0, i, fp)
-		for i in [9,8,7,6,5,4,3]: self.printRow(2, i, fp)
-		print >>fp, divider
-		for i in [1,0,9,8,7,6,5,4,3,2]: self.printRow(i, i, fp)
+	def printTable(self, fp=sys.stdout, jobs=1, hardTotals=False):
+		"""
+		@param hardTotals: show exact hard totals, see HARD_TABLE
+		"""
+		table = tableRows(hardTotals)
+		divider = "---+-" + "-+-".join("-"*13 for i in HOUSE_CARDS)
+		print >>fp, "P\H|", " | ".join(Hand.cardsToStr(i).rjust(13, " ") for i in HOUSE_CARDS)
+		odds = self.calculateTable([row for section in table for row in section], jobs)
+		for section in table:
+			print >>fp, divider
+			for h0, h1 in section: self.printRow(h0, h1, fp, odds)
+
+
+def _calculateSerial(calc, cells):
+	"""calculateCells in this process, trimming the caches between cells (see
+	trimCaches) so that the interned card states and hands stay within
+	--cache-size however many cells there are."""
+	splits = defaultdict(dict)
+	for cell in cells:
+		yield calc._timedOdds(cell, splits[cell[1]])
+		trimCaches()
+
+def _tableWorker(calc, cells, queue):
+	try:
+		# trimming the caches between cells, as in this process
+		results = _calculateSerial(calc, [cell for n, cell in cells])
+		for n, cell in cells:
+			queue.put((n, next(results)))
+	except Exception:
+		queue.put((None, traceback.format_exc()))
@@ -0,0 +1,177 @@
+import csv
+import json
+import re
+import sys
+
+from collections import OrderedDict
+
+from bj.bankroll import kellyFraction, payVariance
+from bj.hand import Hand
+from bj.odds import HardTotal
+
+"""Output formats: text is printTable's coloured table, the rest are written by
+writeCells."""
+FORMATS = ["text", "jsonl", "csv"]
+
+"""Actions that each record has an odds field for, in field order."""
+ACTIONS = "SHDPU"
+
+FIELDS = ["player0", "house", "player1", "total", "action", "margin", "seconds", "error", "variance", "kelly",
+	"approximate", "covariance"] + list(ACTIONS) + ["payoffs"]
+
+def cellRecord(c):
+	"""Flatten a CellOdds into a record of FIELDS.
+
+	Cards are as in calculateOdds (0 is 10/J/Q/K, 1 is Ace, None is not dealt
+	yet), total is the value of the player's cards dealt so far, odds are
+	floats and actions that aren't available are None. Cells for a HardTotal
+	have no player cards, just the total. error is the bound on the error of
+	the odds, with a targetError, otherwise None. With payoffs, variance and
+	kelly are the variance and Kelly fraction (see bj.bankroll) of the best
+	action, and payoffs maps each action to its [[pay, p], ...], otherwise
+	they are None. approximate is whether that variance and kelly are only
+	approximate, since the best action is P and its payoffs are (see
+	CellOdds.approximate). covariance is CellOdds.covariance, for P.
+	"""
+	playerCard0, houseCard, playerCard1 = c.cell
+	if isinstance(playerCard0, HardTotal):
+		playerCard0, total = None, playerCard0.total
+	else:
+		# Hand.add(None) would draw a 10, not leave the card out
+		hand = Hand().add(playerCard0)
+		total = (hand if playerCard1 is None else hand.add(playerCard1)).value
+	odds = dict(c.odds)
+	margin = c.margin
+	record = OrderedDict([
+		("player0", playerCard0),
+		("house", houseCard),
+		("player1", playerCard1),
+		("total", total),
+		("action", c.action),
+		("margin", None if margin is None else float(margin)),
+		("seconds", c.seconds),
+		("error", c.error),
+		("variance", None),
+		("kelly", None),
+		("approximate", None),
+		("covariance", None if c.covariance is None else float(c.covariance)),
+	])
+	record.update((a, float(odds[a]) if a in odds else None) for a in ACTIONS)
+	record["payoffs"] = None
+	if c.payoffs is not None:
+		best = c.payoffs[c.action]
+		record["variance"] = float(payVariance(best))
+		record["kelly"] = kellyFraction(best)
+		record["approximate"] = c.action in c.approximate
+		record["payoffs"] = dict((a, [[float(x), float(p)] for x, p in sorted(d.dist)]) for a, d in c.payoffs.iteritems())
+	return record
+
+def errorStr(error):
+	"""Text to show after odds for the bound on their error, e.g. from
+	CellOdds.error: nothing if it is None, otherwise the bound, or that they
+	are exact if it is 0."""
+	if error is None:
+		return ""
+	return " (exact)" if not error else " (error <= %.3g)" % error
+
+def sweepFields(cells):
+	"""Fields of sweepRecord: the point, then the best action for each cell,
+	named like the hands arguments of bj.py."""
+	return ["seen", "card", "ev", "variance", "kelly", "approximate", "seconds"] + [cellName(cell) for cell in cells]
+
+def parseHand(s):
+	"""Parse a hands argument of bj.py, the inverse of cellName.
+
+	That is a player card and a house card, then optionally a second player
+	card, or T, a hard total from 4 to 20 and a house card. Cards are digits,
+	and the house card and second player card may be X for not dealt yet.
+
+	@return: [playerCard0, houseCard, playerCard1]
+	@raise ValueError: if s isn't a hand
+	"""
+	m = re.match(r"T(\d+)([\dX])$", s)
+	if m:
+		total = int(m.group(1))
+		if not 4 <= total <= 20:
+			raise ValueError("hard total must be from 4 to 20: %r" % s)
+		return [HardTotal(total), _parseCard(m.group(2)), None]
+	if not re.match(r"\d[\dX]{1,2}$", s):
+		raise ValueError("hand must be a player card, a house card and "
+			"optionally another player card, or T, a total and a house card: %r" % s)
+	return [_parseCard(c) for c in s.ljust(3, "X")]
+
+def _parseCard(c):
+	return None if c == "X" else int(c)
+
+def cellName(cell):
+	"""The hands argument of bj.py for cell."""
+	if isinstance(cell[0], HardTotal):
+		cell = cell[:2]
+	return "".join("X" if c is None else str(c) for c in cell)
+
+def sweepRecord(point, cells):
+	"""Flatten a SweepPoint, for the given cells, into a record of
+	sweepFields(cells)."""
+	record = OrderedDict([
+		("seen", point.seen),
+		("card", point.card),
+		("ev", float(point.ev)),
+		("variance", None if point.variance is None else float(point.variance)),
+		("kelly", point.kelly),
+		("approximate", point.approximate),
+		("seconds", point.seconds),
+	])
+	record.update((cellName(cell), odds[0][0]) for cell, odds in zip(cells, point.odds))
+	return record
+
+def writeJsonLines(records, fields, fp=sys.stdout):
+	for r in records:
+		print >>fp, json.dumps(r)
+		fp.flush()
+
+def writeCsv(records, fields, fp=sys.stdout):
+	writer = csv.writer(fp)
+	writer.writerow(fields)
+	fp.flush()
+	for r in records:
+		writer.writerow(["" if v is None else repr(v) if isinstance(v, float) else json.dumps(v) if isinstance(v, dict) else v
+			for v in r.itervalues()])
+		fp.flush()
+
+def writeRecords(records, fields, fmt, fp=sys.stdout):
+	"""Write each record as soon as it is available.
+
+	@param records: iterator of OrderedDict with the given fields
+	@param fmt: "jsonl" or "csv"
+	"""
+	{"jsonl": writeJsonLines, "csv": writeCsv}[fmt](records, fields, fp)
+
+def writeCells(cells, fmt, fp=sys.stdout):
+	"""Write each CellOdds as a record as soon as it is available.
+
+	@param fmt: "jsonl" or "csv"
+	"""
+	writeRecords((cellRecord(c) for c in cells), FIELDS, fmt, fp)
+
+from bj.odds import CellOdds
+from bj.prob import ProbDist, ratio
+from bj.sweep import SweepPoint
+assert cellRecord(CellOdds((0, 6, 6), [("S", 0.5), ("H", 0.25), ("U", -0.5)], 1.0)).values() == [0, 6, 6, 16, "S", 0.25, 1.0, None, None, None, None, None, 0.5, 0.25, None, None, -0.5, None]
+assert cellRecord(CellOdds((0, 6, 6), [("S", 0.5)], 1.0, {"S": 0.125}))["error"] == 0.125
+assert cellRecord(CellOdds((0, 6, None), [("S", 0.5)], 1.0))["total"] == 10
+assert cellRecord(CellOdds((HardTotal(16), 6, None), [("S", 0.5)], 1.0)).values()[:5] == [None, 6, None, 16, "S"]
+assert cellRecord(CellOdds((0, 6, 6), [("S", 0.5)], 1.0, payoffs={"S": ProbDist([(1, ratio(3, 4)), (-1, ratio(1, 4))])}))["payoffs"] == {"S": [[-1, 0.25], [1, 0.75]]}
+assert sweepRecord(SweepPoint(1, 0, None, 0.5, [[("H", 0.25)]], 1.0), [(0, 6, None)]).items() == [("seen", 1), ("card", 0), ("ev", 0.5), ("variance", None), ("kelly", None), ("approximate", None), ("seconds", 1.0), ("06X", "H")]
+assert (errorStr(None), errorStr(0.0), errorStr(0.000123456)) == ("", " (exact)", " (error <= 0.000123)")
+assert cellName((HardTotal(16), 8, None)) == "T168"
+assert parseHand(cellName((HardTotal(16), 8, None))) == [HardTotal(16), 8, None]
+assert parseHand("06") == [0, 6, None]
+assert parseHand("1X6") == [1, None, 6]
+assert parseHand("T16X") == [HardTotal(16), None, None]
+for __s in ("1", "X06", "0666", "T218", "T16", "06a", ""):
+	try:
+		parseHand(__s)
+	except ValueError:
+		pass
+	else:
+		assert False, __s
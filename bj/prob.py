@@ -1,21 +1,33 @@
 from fractions import Fraction
 import math
+import operator
 
-"""Allow distributions to omit events totalling this probability.
+import bj.stats
+
+"""Allow the probabilities of a distribution, plus whatever was pruned from it
+(see ProbDist.pruned), to total this much more or less than 1.
 
 This acts as a sanity check, to ensure that other optimisations you set, such
-as PROB_EVENT_TOLERANCE, or using floats instead of Fractions, don't result in
-wildly-inaccurate results.
+as using floats instead of Fractions, don't result in wildly-inaccurate
+results.
 """
 PROB_SPACE_TOLERANCE = 0
 
 """Ignore events less likely than this probability when doing ProbDist.bind.
 
-This improves performance at the expense of accuracy, but the latter may be
-acceptable for your application.
+This improves performance at the expense of accuracy. The probability dropped
+is kept track of, so that values calculated from pruned distributions come
+with a bound on their error, see Bounded.
 """
 PROB_EVENT_TOLERANCE = 0
 
+"""Use Rational instead of Fraction for exact probabilities.
+
+Results are the same, but the arithmetic in the hot loop avoids normalising
+every intermediate value.
+"""
+PROB_RATIONAL = True
+
 def add_module_opts(argparser):
 	argparser.add_argument(
 		"--prob-space-tolerance", help="Allow the sum of probabilities in a "
@@ -23,30 +35,235 @@ def add_module_opts(argparser):
 		default=0, type=float)
 	argparser.add_argument(
 		"--prob-event-tolerance", help="When applying transformations (i.e. "
-		"using ProbDist.bind), drop events that are less likely than this. If "
-		"you set this and get an AssertionError, you will also need to set "
-		"--prob-space-tolerance. Default: %(default)s",
+		"using ProbDist.bind), drop events that are less likely than this. "
+		"See also --target-error, which picks this for you. Default: %(default)s",
 		default=0, type=float)
+	argparser.add_argument(
+		"--prob-fraction", help="Do exact probability arithmetic with "
+		"fractions.Fraction. By default we keep integer numerators over "
+		"unreduced denominators (see bj.prob.Rational) and only reduce the "
+		"final results, which gives the same results much faster. Default: %(default)s",
+		default=False, action="store_true")
 	old_parse = argparser.parse_args
 	def parse_args(*args, **kwargs):
-		global PROB_SPACE_TOLERANCE, PROB_EVENT_TOLERANCE
+		global PROB_SPACE_TOLERANCE, PROB_EVENT_TOLERANCE, PROB_RATIONAL
 		args = old_parse(*args, **kwargs)
 		PROB_SPACE_TOLERANCE = args.prob_space_tolerance
 		PROB_EVENT_TOLERANCE = args.prob_event_tolerance
+		PROB_RATIONAL = not args.prob_fraction
 		return args
 	argparser.parse_args = parse_args
 
+class Rational(object):
+	"""Exact rational number that is not kept in lowest terms.
+
+	Drawing from a TotalCardState gives probabilities count/cardsleft, so the
+	probability of a sequence of draws has a denominator that is a falling
+	factorial of the cards left, and the denominators of events at different
+	depths divide each other. Multiplying and adding such values without ever
+	taking a gcd stays exact and the numbers stay small; we only fall back to
+	cross-multiplying when neither denominator divides the other.
+
+	Other numbers with numerator and denominator (int, long, Fraction) can be
+	mixed in; floats give floats. Use toFraction to get the reduced value.
+	"""
+	__slots__ = ('num', 'den')
+
+	def __init__(self, num, den=1):
+		if den <= 0:
+			if not den: raise ZeroDivisionError
+			num, den = -num, -den
+		self.num = num
+		self.den = den
+
+	def toFraction(self):
+		return Fraction(self.num, self.den)
+
+	def __add__(self, other):
+		if other.__class__ is Rational:
+			n2, d2 = other.num, other.den
+		elif isinstance(other, float):
+			return float(self) + other
+		else:
+			try:
+				n2, d2 = other.numerator, other.denominator
+			except AttributeError:
+				return NotImplemented
+		n1, d1 = self.num, self.den
+		if d1 == d2:
+			return Rational(n1 + n2, d1)
+		if not d2 % d1:
+			return Rational(n1 * (d2 // d1) + n2, d2)
+		if not d1 % d2:
+			return Rational(n1 + n2 * (d1 // d2), d1)
+		return Rational(n1 * d2 + n2 * d1, d1 * d2)
+
+	__radd__ = __add__
+
+	def __neg__(self):
+		return Rational(-self.num, self.den)
+
+	def __sub__(self, other):
+		return self + -other
+
+	def __rsub__(self, other):
+		return -self + other
+
+	def __mul__(self, other):
+		if other.__class__ is Rational:
+			return Rational(self.num * other.num, self.den * other.den)
+		elif isinstance(other, float):
+			return float(self) * other
+		try:
+			return Rational(self.num * other.numerator, self.den * other.denominator)
+		except AttributeError:
+			return NotImplemented
+
+	__rmul__ = __mul__
+
+	def __div__(self, other):
+		if other.__class__ is Rational:
+			return Rational(self.num * other.den, self.den * other.num)
+		elif isinstance(other, float):
+			return float(self) / other
+		return Rational(self.num * other.denominator, self.den * other.numerator)
+
+	def __rdiv__(self, other):
+		if isinstance(other, float):
+			return other / float(self)
+		return Rational(other.numerator * self.den, other.denominator * self.num)
+
+	__truediv__, __rtruediv__ = __div__, __rdiv__
+
+	def __float__(self):
+		# correctly rounded, like Fraction
+		return operator.truediv(self.num, self.den)
+
+	def __cmp__(self, other):
+		if other.__class__ is Rational:
+			n2, d2 = other.num, other.den
+		elif isinstance(other, float):
+			return cmp(float(self), other)
+		else:
+			n2, d2 = other.numerator, other.denominator
+		return cmp(self.num * d2, n2 * self.den)
+
+	def __eq__(self, other):
+		try:
+			return self.__cmp__(other) == 0
+		except AttributeError:
+			return NotImplemented
+
+	def __ne__(self, other):
+		try:
+			return self.__cmp__(other) != 0
+		except AttributeError:
+			return NotImplemented
+
+	def __hash__(self):
+		return hash(self.toFraction())
+
+	def __nonzero__(self):
+		return bool(self.num)
+
+	def __repr__(self):
+		return "Rational(%r, %r)" % (self.num, self.den)
+
+def ratio(num, den=1):
+	"""An exact probability num/den, as a Rational or Fraction, see PROB_RATIONAL."""
+	return Rational(num, den) if PROB_RATIONAL else Fraction(num, den)
+
+def exact(x):
+	"""Reduce x to a Fraction if it is a Rational."""
+	return x.toFraction() if x.__class__ is Rational else x
+
+class Bounded(object):
+	"""A value calculated from pruned distributions, with a bound on how far
+	it can be from the value calculated without pruning.
+
+	Supports the arithmetic that values go through (adding, and multiplying
+	by exact numbers such as probabilities), and compares by value. Use best
+	instead of max, since the bound on the max of two values is the larger of
+	their bounds, not the bound of the larger value.
+	"""
+	__slots__ = ('value', 'err')
+
+	def __init__(self, value, err):
+		self.value = value
+		self.err = err
+
+	def __add__(self, other):
+		if other.__class__ is Bounded:
+			return Bounded(self.value + other.value, self.err + other.err)
+		return Bounded(self.value + other, self.err)
+
+	__radd__ = __add__
+
+	def __neg__(self):
+		return Bounded(-self.value, self.err)
+
+	def __sub__(self, other):
+		return self + -other
+
+	def __rsub__(self, other):
+		return -self + other
+
+	def __mul__(self, other):
+		if other.__class__ is Bounded:
+			raise TypeError("can't multiply two Bounded values")
+		return Bounded(self.value * other, self.err * math.fabs(other))
+
+	__rmul__ = __mul__
+
+	def __float__(self):
+		return float(self.value)
+
+	def __lt__(self, other):
+		return self.value < valueOf(other)
+
+	def __le__(self, other):
+		return self.value <= valueOf(other)
+
+	def __gt__(self, other):
+		return self.value > valueOf(other)
+
+	def __ge__(self, other):
+		return self.value >= valueOf(other)
+
+	def __eq__(self, other):
+		return self.value == valueOf(other)
+
+	def __ne__(self, other):
+		return self.value != valueOf(other)
+
+	def __repr__(self):
+		return "Bounded(%r, %r)" % (self.value, self.err)
+
+def valueOf(x):
+	"""The value of x without its error bound, if it has one."""
+	return x.value if x.__class__ is Bounded else x
+
+def errorOf(x):
+	"""The error bound of x, 0 if it isn't Bounded."""
+	return x.err if x.__class__ is Bounded else 0
+
+def best(*values):
+	"""max of values, with the largest of their error bounds."""
+	if not any(v.__class__ is Bounded for v in values):
+		return max(values)
+	return Bounded(max(valueOf(v) for v in values), max(errorOf(v) for v in values))
+
 def probTotal(dist):
 	return sum(v[1] for v in dist)
 
-def checkProb(dist):
+def checkProb(dist, pruned=0):
 	if not all(v[1] >= 0 for v in dist):
 		raise ValueError()
 	total = probTotal(dist)
 	try:
-		assert math.fabs(total - 1.0) <= PROB_SPACE_TOLERANCE
+		assert math.fabs(total + pruned - 1.0) <= PROB_SPACE_TOLERANCE
 	except AssertionError, e:
-		print math.fabs(total), dist
+		print math.fabs(total), pruned, dist
 		raise
 
 class ProbDist(object):
@@ -56,38 +273,62 @@ class ProbDist(object):
 
 	See the PROB_*_TOLERANCE variables for tweaks you can apply; in particular
 	PROB_SPACE_TOLERANCE must be set when using floats.
+
+	Attributes:
+		pruned: Total probability of the events left out of this distribution
+		    by PROB_EVENT_TOLERANCE, in any of the binds that led to it.
 	"""
+	# distributions are cached by the thousand, don't give each a __dict__
+	__slots__ = ('dist', 'pruned')
 
 	@classmethod
 	def inject(cls, item):
-		return cls([(item, Fraction(1))])
+		return cls([(item, ratio(1))])
 
-	def __init__(self, dist):
-		checkProb(dist)
+	def __init__(self, dist, pruned=0):
+		stats = bj.stats.STATS
+		if stats is None:
+			checkProb(dist, pruned)
+		else:
+			with stats.timer("checkProb"):
+				checkProb(dist, pruned)
+		self.pruned = pruned
 		# merge duplicates in values
 		d = {}
 		for item, p in dist:
 			d[item] = d.get(item, 0) + p
 		self.dist = sorted(d.items())
+		if stats is not None:
+			stats.distCreated(self.__class__, len(self.dist))
 
 	def bind(self, f):
 		"""
 		@param f: f(item) -> ProbDist([(item, p)])
 		"""
 		newdist = []
+		pruned = []
+		mass = self.pruned
 		for item, p in self.dist:
-			if p < PROB_EVENT_TOLERANCE: continue
-			dist = f(item).dist
-			checkProb(dist)
-			newdist.extend([(v[0], p*v[1]) for v in dist])
-		return self.__class__(newdist)
+			if p < PROB_EVENT_TOLERANCE:
+				pruned.append(p)
+				continue
+			# no need to checkProb(dist), ProbDist.__init__ already did
+			d = f(item)
+			newdist.extend([(v[0], p*v[1]) for v in d.dist])
+			if d.pruned:
+				mass += p * d.pruned
+		if pruned:
+			mass += sum(pruned)
+		if bj.stats.STATS is not None:
+			bj.stats.STATS.distBound(pruned)
+		return self.__class__(newdist, mass)
 
 	def map(self, f):
 		"""
 		@param f: f(item) -> item2
 		"""
 		# short for self.bind(f compose self.__class__.inject)
-		return self.__class__([(f(item), p) for item, p in self.dist])
+		return self.__class__([(f(item), p) for item, p in self.dist], self.pruned)
 
 	def filter(self, f):
 		"""
@@ -97,7 +338,8 @@ class ProbDist(object):
 
 	def given(self, f):
 		"""
-		Condition this distribution on the given filter.
+		Condition this distribution on the given filter. The child dist is
+		conditional on the events that were kept, so has nothing pruned.
 
 		@param f: f(item) -> bool
 		@return (p, d) where
@@ -108,14 +350,34 @@ class ProbDist(object):
 		t = probTotal(g)
 		return t, self.__class__([(item, p/t) for item, p in g]) if g else None
 
-	def expect(self, f=id):
+	def expect(self, f=id, bound=None):
 		"""
 		Calculate the expected value of this distribution
+
+		@param bound: the most that |f| can be, to bound the error from any
+		    probability that was pruned. If given and some was, the result is
+		    Bounded.
 		"""
-		return sum(f(item)*p for item, p in self.dist)
+		value = sum(f(item)*p for item, p in self.dist)
+		return self._bounded(value, bound)
+
+	def _bounded(self, value, bound):
+		if bound is None or not self.pruned:
+			return value
+		return Bounded(0, self.pruned * bound) + value
 
 	def __str__(self):
 		return "\n".join("%.8f %s" % (p, item) for item, p in self.dist)
 
+assert Rational(1, 6) + Rational(1, 30) == Fraction(1, 5) and (Rational(1, 6) + Rational(1, 30)).den == 30
+assert Rational(3, 4) * Fraction(3, 2) - 1 == Fraction(1, 8) and Rational(1, 2) / Rational(1, 4) == 2
+assert Rational(1, 3) < 0.5 and Rational(1, 3) > Fraction(1, 4) and max(Rational(1, 3), Rational(2, 7)).num == 1
 __f = lambda i: ProbDist([(i, 0.5), (i*2, 0.5)])
 assert ProbDist.inject(1).bind(__f).bind(__f).bind(__f).dist == [(1, 0.125), (2, 0.375), (4, 0.375), (8, 0.125)]
+assert best(1, Bounded(2, 0.5), Bounded(0, 1)).err == 1 and best(1, 2) == 2
+assert (Rational(1, 2) + Bounded(1, 0.25) * Rational(1, 2)).err == 0.125
+__g = lambda i: ProbDist([(i, 0.5), (i*2, 0.25), (i*3, 0.25)])
+PROB_EVENT_TOLERANCE = 0.3
+assert ProbDist.inject(1).bind(__g).bind(__g).pruned == 0.5
+assert ProbDist.inject(1).bind(__g).bind(__g).expect(bound=1).err == 0.5
+PROB_EVENT_TOLERANCE = 0
@@ -2,61 +2,91 @@ from collections import namedtuple
 from fractions import Fraction
 
 from bj.hand import Hand as H
-from bj.game import GameStateDist
-
-class BJRule(namedtuple('BJRule', 'name pay playHouse actions defaultDecks')):
-	pass
-
-def __BJ_pay(h, p):
-	if p.isBust():
-		return -1
-	if p.isNat():
-		return 0 if h.isNat() else Fraction(3,2)
-	if h.isBust():
-		return 1
-	if h.isNat():
-		return -1
-	hm = h.value
-	pm = p.value
-	return 0 if hm == pm else 1 if pm > hm else -1
-
-def __BJ_playHouse(gs):
-	if gs.done:
-		return GameStateDist.inject(gs)
-	h = gs.currentHand()
-	if h.canHit() and (h.value <= 16 or h.isA17()):
-		return gs.hit()
-	else:
-		return GameStateDist.inject(gs.turnDone())
+from bj.game import GameState, GameStateDist
+
+class BJRule(namedtuple('BJRule', 'name actions defaultDecks standOn hitSoft17 push22 naturalPays')):
+	"""A variant of Blackjack, described as data.
+
+	The house's play and the pay for every pair of hands are worked out from
+	these once per rule, into tables indexed by Hand (see houseHits and
+	bj.house.payTable), so variants cost the same as the standard game.
+
+	The house's hole card is drawn after the players are done, so a house
+	natural also takes doubled and split bets, as in the European no-hole-card
+	game, and surrender is early surrender.
+
+	Attributes:
+		name: Shown in output, and identifies the rule in caches and stores.
+		actions: Actions the player can take, see OddsCalculator.
+		defaultDecks: Number of decks in play, unless set otherwise.
+		standOn: The house stands on this total or more.
+		hitSoft17: Whether the house hits a soft 17 anyway.
+		push22: Whether a house bust on exactly 22 pushes against all player
+		    hands that aren't naturals or bust.
+		naturalPays: What a player natural pays against anything but a house
+		    natural, as a multiple of the bet.
+	"""
+	__slots__ = ()
+
+	# compiled houseHits tables, keyed by rule
+	_houseHits = {}
+
+	def __hash__(self):
+		# cheaper than hashing every field, for all the caches keyed by rule
+		return hash(self.name)
+
+	def variant(self, **changes):
+		"""This rule with some attributes changed, named after the changes."""
+		name = "%s (%s)" % (self.name, ", ".join("%s=%s" % (k, "".join(v) if isinstance(v, tuple) else v)
+			for k, v in sorted(changes.items())))
+		return self._replace(name=name, **changes)
+
+	@property
+	def maxPay(self):
+		"""The most that any hand can win or lose, as a multiple of the bet."""
+		return max(1, self.naturalPays)
+
+	def _hits(self, h):
+		return h.canHit() and (h.value < self.standOn or (self.hitSoft17 and h.isA17()))
+
+	def houseHits(self, h):
+		"""Whether the house hits h, by lookup into a table over every Hand."""
+		table = BJRule._houseHits.get(self)
+		if table is None:
+			table = BJRule._houseHits[self] = [None] + [self._hits(q) for q in H.all()[1:]]
+		try:
+			return table[h]
+		except IndexError:
+			# h was created after the table was compiled
+			return self._hits(h)
+
+	def playHouse(self, gs):
+		"""Play the house's next step, as a strategy for GameStateDist.execRound."""
+		if gs.done:
+			return GameStateDist.inject(gs)
+		return gs.hit() if self.houseHits(gs.currentHand()) else GameStateDist.inject(gs.turnDone())
+
+	def pay(self, h, p):
+		"""Pay for player hand p against finished house hand h, as a multiple
+		of the bet."""
+		if p.isBust():
+			return -1
+		if p.isNat():
+			return 0 if h.isNat() else self.naturalPays
+		if h.isBust():
+			return 0 if self.push22 and h.is22() else 1
+		if h.isNat():
+			return -1
+		hm = h.value
+		pm = p.value
+		return 0 if hm == pm else 1 if pm > hm else -1
 
 """
 Blackjack standard.
 
 Blackjack pays 3:2. Dealer must hit soft-17.
 """
-BJ = BJRule("Blackjack", __BJ_pay, __BJ_playHouse, ('H', 'S', 'D', 'P', 'U'), 8)
-
-def __BJS_pay(h, p):
-	if p.isBust():
-		return -1
-	if p.isNat():
-		return 0 if h.isNat() else 1
-	if h.isBust():
-		return 0 if h.is22() else 1
-	if h.isNat():
-		return -1
-	hm = h.value
-	pm = p.value
-	return 0 if hm == pm else 1 if pm > hm else -1
-
-def __BJS_playHouse(gs):
-	if gs.done:
-		return GameStateDist.inject(gs)
-	h = gs.currentHand()
-	if h.canHit() and (h.value <= 16 or h.isA17()):
-		return gs.hit()
-	else:
-		return GameStateDist.inject(gs.turnDone())
+BJ = BJRule("Blackjack", ('H', 'S', 'D', 'P', 'U'), 8, standOn=17, hitSoft17=True, push22=False, naturalPays=Fraction(3,2))
 
 """
 Blackjack Switch (Las Vegas).
@@ -64,36 +94,24 @@ Blackjack Switch (Las Vegas).
 Cannot surrender. Blackjack pays 1:1. Dealer must hit soft-17 and pushes on 22.
 We do not (yet) simulate or estimate a strategy for switching.
 """
-BJS = BJRule("Blackjack Switch", __BJS_pay, __BJS_playHouse, ('H', 'S', 'D', 'P'), 8)
-
-def __BJV_pay(h, p):
-	if p.isBust():
-		return -1
-	if p.isNat():
-		return 0 if h.isNat() else 1
-	if h.isBust():
-		return 1
-	if h.isNat():
-		return -1
-	hm = h.value
-	pm = p.value
-	return 0 if hm == pm else 1 if pm > hm else -1
-
-def __BJV_playHouse(gs):
-	if gs.done:
-		return GameStateDist.inject(gs)
-	h = gs.currentHand()
-	if h.canHit() and h.value <= 16:
-		return gs.hit()
-	else:
-		return GameStateDist.inject(gs.turnDone())
+BJS = BJRule("Blackjack Switch", ('H', 'S', 'D', 'P'), 8, standOn=17, hitSoft17=True, push22=True, naturalPays=1)
 
 """
 Blackjack, as seen on some of the video machines in Las Vegas.
 
 Can only hit/switch. Blackjack pays 1:1.
 """
-BJV = BJRule("Blackjack on the video machines", __BJV_pay, __BJV_playHouse, ('H', 'S'), 2)
+BJV = BJRule("Blackjack on the video machines", ('H', 'S'), 2, standOn=17, hitSoft17=False, push22=False, naturalPays=1)
+
+"""
+European Blackjack.
+
+Cannot surrender. Blackjack pays 3:2. Dealer stands on soft-17.
+"""
+BJE = BJRule("European Blackjack", ('H', 'S', 'D', 'P'), 6, standOn=17, hitSoft17=False, push22=False, naturalPays=Fraction(3,2))
+
+"""Rules that can be chosen by name, e.g. with bj.py --rule."""
+RULES = ["BJ", "BJS", "BJV", "BJE"]
 
 assert BJS.pay(H(1,10,0,1), H(1,10,0,1)) == 0
 assert BJS.pay(H(1,10,0,1), H(0,20)) == -1
@@ -103,3 +121,11 @@ assert BJS.pay(H(0,22), H(0,7)) == 0
 assert BJS.pay(H(0,7), H(0,22)) == -1
 assert BJS.pay(H(0,7), H(0,20)) == 1
 assert BJS.pay(H(0,20), H(0,7)) == -1
+assert BJ.houseHits(H(1,6)) and not BJV.houseHits(H(1,6)) and not BJ.houseHits(H(1,10,0,1))
+assert BJ.maxPay == Fraction(3,2) and BJS.maxPay == 1
+assert BJ.variant(naturalPays=Fraction(6,5), actions=('H', 'S')).name == "Blackjack (actions=HS, naturalPays=6/5)"
+
+# these check bj.game, which can't import this module back for them
+from bj.card import TotalCardState
+assert GameStateDist.inject(GameState(TotalCardState(), [H(1,10,0,1),H(0,20,0,0)], 0))._playUntilDone(BJS.playHouse).expectPay(BJS.pay)[1] == -1.0
+assert GameStateDist.inject(GameState(TotalCardState(), [H(1,10,0,1),H(1,10,0,1)], 0))._playUntilDone(BJS.playHouse).expectPay(BJS.pay)[1] == 0.0
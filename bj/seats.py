@@ -0,0 +1,93 @@
+import bj.prob
+
+from bj.cache import LRUCache, trimCaches
+from bj.hand import Hand
+from bj.odds import optimalValue, standValue
+from bj.prob import ProbDist, exact
+
+_playedCards = LRUCache("played cards")
+
+def playedCards(rule, p, cards, h):
+	"""Distribution of the card states left after playing p with optimal
+	hit/stand (as in optimalValue) against house hand h.
+
+	@return: ProbDist([(card state, p)])
+	"""
+	def solve():
+		if not p.canHit() or optimalValue(rule, p, cards, h) <= standValue(rule, p, cards, h):
+			return ProbDist.inject(cards)
+		return cards.draw().bind(lambda (card, nextcards): playedCards(rule, p.add(card), nextcards, h))
+	return _playedCards.get((rule, p, cards, h, bj.prob.PROB_EVENT_TOLERANCE), solve)
+
+def seatHand(card0, card1):
+	"""Hand of a player dealt card0 and card1, reduced to just its total
+	unless it is a natural, since that is all that hit/stand play and pay
+	look at."""
+	p = Hand().add(card0).add(card1)
+	return p if p.isNat() else Hand(p.ace, p.osum)
+
+_seatValues = LRUCache("seat values")
+_seatLeaves = LRUCache("seat leaves")
+
+def dealSeat(cards):
+	"""Deal 2 cards to a new player.
+
+	@return: ProbDist([((player hand, card state), p)])
+	"""
+	return cards.draw().bind(lambda (card0, cards0):
+		cards0.draw().map(lambda (card1, cards1): (seatHand(card0, card1), cards1)))
+
+def seatValue(rule, cards, h):
+	"""Expected pay of a player dealt from cards against house hand h,
+	playing hit/stand optimally. Memoised, so every seat that can be dealt
+	from the same card state shares it."""
+	return _seatValues.get((rule, cards, h, bj.prob.PROB_EVENT_TOLERANCE), lambda:
+		exact(dealSeat(cards).expect(lambda (p, nextcards): optimalValue(rule, p, nextcards, h), rule.maxPay)))
+
+def seatLeaves(rule, cards, h):
+	"""Distribution of the card states that a player dealt from cards leaves
+	behind, playing as in seatValue. Memoised like it.
+
+	@return: ProbDist([(card state, p)])
+	"""
+	return _seatLeaves.get((rule, cards, h, bj.prob.PROB_EVENT_TOLERANCE), lambda:
+		dealSeat(cards).bind(lambda (p, nextcards): playedCards(rule, p, nextcards, h)))
+
+def seatOdds(rule, initCards, numSeats, houseCard=None):
+	"""Expected pay for each of numSeats players at one table, sharing the
+	cards, each playing hit/stand optimally.
+
+	GameStateDist.initGame(numSeats + 1, ...) would track every player's hand
+	together with the cards, which grows multiplicatively with each seat.
+	Instead this keeps just the distribution of the shared state (the house
+	hand and the cards left) that each seat faces, its marginal, and steps it
+	from one seat to the next with seatLeaves:
+
+	- each seat is dealt its cards when its turn comes up, which gives the
+	  same odds as dealing them all at the start as long as players don't
+	  look at the cards of the players after them;
+	- each seat is paid as soon as it is done (see standPay), since none of
+	  them can depend on what the house draws after everyone is done either;
+	- only the cards left are passed on to the next seat.
+
+	So a seat's cost is the number of card states that the seats before it
+	can leave behind (just one for NullCardState), less the ones an earlier
+	seat already faced, since seatValue and seatLeaves are memoised per
+	state. Each seat's decisions can use all the cards played before its
+	turn. The caches are trimmed between seats (see trimCaches), so however
+	many seats there are they stay within --cache-size, though a seat then
+	no longer shares anything with the seats before the trim.
+
+	@param houseCard: the house's up card, or None for any
+	@return: [0] + [expected pay for each seat], indexed like GameState.hands
+	    (play goes from the highest index down). Pays are Bounded if the
+	    shared states were pruned, see PROB_EVENT_TOLERANCE.
+	"""
+	shared = initCards.draw(houseCard).map(lambda (card, cards): (Hand().add(card), cards))
+	odds = [0] * (numSeats + 1)
+	for i in xrange(numSeats, 0, -1):
+		odds[i] = shared._bounded(sum(exact(p) * seatValue(rule, cards, h) for (h, cards), p in shared.dist), rule.maxPay)
+		if i > 1:
+			shared = shared.bind(lambda (h, cards): seatLeaves(rule, cards, h).map(lambda nextcards: (h, nextcards)))
+			trimCaches()
+	return odds
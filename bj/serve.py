@@ -0,0 +1,185 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import stat
+import threading
+import urlparse
+
+from ast import literal_eval
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import TCPServer, ThreadingMixIn, UnixStreamServer
+
+from bj.cache import trimCaches
+from bj.odds import HOUSE_CARDS, tableRows
+from bj.output import cellName, cellRecord, parseHand
+
+class OddsHandler(BaseHTTPRequestHandler):
+	"""JSON API over the server's OddsCalculator.
+
+	GET /odds?hand=086&hand=T168
+		Records (see cellRecord) for each of the hands, given as in the hands
+		arguments of bj.py.
+	GET /table[?hard_totals=1]
+		Records for every cell of the strategy table, in table order.
+
+	Both take an optional state=, a python expression for the card state to
+	calculate from, instead of the server's initial one, as in --card-state.
+	Responses are {"records": [...]}, or {"error": "..."} with a 4xx or 5xx
+	status: 400 for a query that can't be parsed, or whose hands can't be
+	dealt from the card state.
+	"""
+
+	def do_GET(self):
+		url = urlparse.urlparse(self.path)
+		query = urlparse.parse_qs(url.query)
+		route = {"/odds": self.oddsCells, "/table": self.tableCells}.get(url.path)
+		if route is None:
+			return self.reply(404, {"error": "no such path: %s" % url.path})
+		try:
+			calc = self.server.calc
+			if "state" in query:
+				calc = calc._replace(initCards=self.server.cardsFor(parseState(query["state"][-1])))
+			cells = route(query)
+		except (ValueError, SyntaxError, TypeError), e:
+			# card states raise TypeError for some states of the wrong shape
+			return self.reply(400, {"error": "bad query: %s" % (str(e) or e.__class__.__name__)})
+		try:
+			if self.server.pool is None:
+				# the caches aren't safe to update from several threads at
+				# once, and the GIL means we couldn't calculate any faster in
+				# parallel anyway
+				with self.server.lock:
+					records = calculateRecords(calc, cells)
+			else:
+				records = self.server.pool.apply(_workerRecords, (calc.initCards, cells))
+		except ValueError, e:
+			# e.g. a card that isn't left in the card state
+			return self.reply(400, {"error": str(e) or e.__class__.__name__})
+		except Exception, e:
+			logging.exception("failed to calculate %s", self.path)
+			return self.reply(500, {"error": "%s: %s" % (e.__class__.__name__, e)})
+		self.reply(200, {"records": records})
+
+	def oddsCells(self, query):
+		if not query.get("hand"):
+			raise ValueError("no hand given")
+		return [tuple(parseHand(h)) for h in query["hand"]]
+
+	def tableCells(self, query):
+		hardTotals = query.get("hard_totals", ["0"])[-1] not in ("", "0")
+		return [(h0, i, h1) for section in tableRows(hardTotals) for h0, h1 in section for i in HOUSE_CARDS]
+
+	def reply(self, code, body):
+		data = json.dumps(body)
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def address_string(self):
+		# Unix sockets have no client address
+		return self.client_address[0] if self.client_address else "unix"
+
+	def log_message(self, format, *args):
+		logging.debug("%s %s", self.address_string(), format % args)
+
+def calculateRecords(calc, cells):
+	"""cellRecord for each of cells, calculated with calc.
+
+	The caches are trimmed afterwards (see trimCaches), so that however many
+	card states are asked about, they never hold much more than --cache-size
+	entries.
+
+	@raise ValueError: naming the cell, if one can't be calculated from
+	    calc.initCards
+	"""
+	records = []
+	try:
+		for c in calc.calculateCells(cells):
+			records.append(cellRecord(c))
+	except ValueError, e:
+		raise ValueError("can't calculate %s from %r: %s" % (
+			cellName(cells[len(records)]), calc.initCards, str(e) or e.__class__.__name__))
+	finally:
+		trimCaches()
+	return records
+
+# the server's calculator, for its worker processes, which are forked with it
+_serverCalc = None
+
+def _workerRecords(initCards, cells):
+	return calculateRecords(_serverCalc._replace(initCards=initCards), cells)
+
+def _initWorker():
+	# leave ^C to the server, which stops its workers in server_close
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def parseState(s):
+	"""Parse a state= query, which is a list of card counts as in
+	--card-state, or None.
+
+	@raise ValueError: if s isn't one
+	"""
+	state = literal_eval(s)
+	if state is not None and not (isinstance(state, (list, tuple)) and
+			all(isinstance(n, (int, long)) and not isinstance(n, bool) for n in state)):
+		raise ValueError("state must be a list of card counts: %s" % s)
+	return state
+
+class PoolMixIn:
+	"""Stop the server's worker processes, if any, along with it."""
+	pool = None
+
+	def server_close(self):
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+		TCPServer.server_close(self)
+
+class ThreadingOddsServer(PoolMixIn, ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class ThreadingUnixOddsServer(PoolMixIn, ThreadingMixIn, UnixStreamServer):
+	daemon_threads = True
+
+	def server_bind(self):
+		# replace a socket left over from an earlier server, but nothing else
+		try:
+			if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+				os.unlink(self.server_address)
+		except OSError:
+			pass
+		UnixStreamServer.server_bind(self)
+
+def makeServer(calc, address, cardsFor, jobs=1):
+	"""A server answering OddsHandler requests with calc, one thread per
+	connection.
+
+	Everything calculated stays in the memo caches between requests, so
+	repeated and related queries (e.g. the same shoe a few cards later) are
+	answered from warm caches, until they grow past --cache-size and are
+	cleared, see calculateRecords.
+
+	@param address: [host:]port for HTTP over TCP, or a path (containing a
+	    /) for HTTP over a Unix socket
+	@param cardsFor: f(state) -> the card state for a state= query
+	@param jobs: number of worker processes to calculate in. Each request is
+	    calculated by whichever one is free, with its own caches. With 1,
+	    requests are calculated one at a time in this process.
+	"""
+	global _serverCalc
+	if "/" in address:
+		server = ThreadingUnixOddsServer(address, OddsHandler)
+	else:
+		host, _, port = address.rpartition(":")
+		server = ThreadingOddsServer((host or "localhost", int(port)), OddsHandler)
+	server.calc = calc
+	server.cardsFor = cardsFor
+	server.lock = threading.Lock()
+	if jobs > 1:
+		_serverCalc = calc
+		server.pool = multiprocessing.Pool(jobs, _initWorker)
+	return server
@@ -0,0 +1,242 @@
+import fractions
+import math
+
+from collections import namedtuple
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from bj.card import NullCardState
+from bj.hand import Hand
+from bj.house import houseHand, payTable
+from bj.odds import optimalValue, standValue
+
+
+class Estimate(namedtuple('Estimate', 'mean stderr rounds')):
+	"""Monte Carlo estimate of an expected pay."""
+
+	def interval(self, z=1.96):
+		return (self.mean - z * self.stderr, self.mean + z * self.stderr)
+
+	def zscore(self, value):
+		"""How many standard errors value is away from our mean."""
+		d = float(value) - self.mean
+		return d / self.stderr if self.stderr else 0.0 if not d else math.copysign(float("inf"), d)
+
+	def scale(self, k):
+		return self.__class__(k * self.mean, abs(k) * self.stderr, self.rounds)
+
+	def __str__(self):
+		return "%+.4f+-%.4f" % (self.mean, 1.96 * self.stderr)
+
+
+class CrossCheck(namedtuple('CrossCheck', 'action exact estimate')):
+	"""An exact (or tolerance-approximated) odds value against its estimate."""
+
+	@property
+	def z(self):
+		return self.estimate.zscore(self.exact)
+
+	def __str__(self):
+		return "%s %+.4f vs %s (z=%+.2f)" % (self.action, self.exact, self.estimate, self.z)
+
+
+class _Tally(object):
+	def __init__(self):
+		self.n, self.sum, self.sumsq = 0, 0.0, 0.0
+
+	def add(self, values):
+		self.n += len(values)
+		self.sum += values.sum()
+		self.sumsq += numpy.dot(values, values)
+
+	def estimate(self):
+		mean = self.sum / self.n
+		var = max(0.0, self.sumsq / self.n - mean * mean)
+		return Estimate(mean, math.sqrt(var / max(1, self.n - 1)), self.n)
+
+
+class Shoe(object):
+	"""The cards of a batch of rounds being simulated at once.
+
+	Each round has its own counts of the cards left, which start off as
+	initCards.urn() and are drawn from independently.
+	"""
+	def __init__(self, initCards, rounds, rng):
+		counts, values, replace = initCards.urn()
+		# enough columns for every slot's values to repeat evenly
+		m = reduce(lambda m, n: m * n // fractions.gcd(m, n), (len(v) for v in values))
+		self.counts = numpy.tile(numpy.array(counts, dtype=numpy.int64), (rounds, 1))
+		self.values = numpy.array([v * (m // len(v)) for v in values])
+		self.slots = dict((v, i) for i, vs in enumerate(values) for v in vs)
+		self.replace = replace
+		self.rng = rng
+
+	def copy(self):
+		shoe = self.__class__.__new__(self.__class__)
+		shoe.__dict__.update(self.__dict__)
+		shoe.counts = self.counts.copy()
+		return shoe
+
+	def draw(self, v=None, mask=None):
+		"""Draw a card for every round in mask (default all of them).
+
+		@param v: draw this specific card, like CardState.draw(v)
+		@return: array of the card drawn for each round. Values for rounds
+		    outside of mask are meaningless.
+		"""
+		n = len(self.counts)
+		rows = numpy.arange(n) if mask is None else numpy.flatnonzero(mask)
+		cards = numpy.zeros(n, dtype=numpy.int64)
+		if v is None:
+			cum = self.counts[rows].cumsum(1)
+			r = (self.rng.random_sample(len(rows)) * cum[:, -1]).astype(numpy.int64)
+			slot = (cum <= r[:, None]).sum(1)
+			cards[rows] = self.values[slot, self.rng.randint(self.values.shape[1], size=len(rows))]
+		else:
+			slot = numpy.repeat(self.slots[v], len(rows))
+			cards[rows] = v
+		if not self.replace:
+			self.counts[rows, slot] -= 1
+			if (self.counts[rows, slot] < 0).any():
+				raise ValueError("no cards of value %s left" % v)
+		return cards
+
+
+class MonteCarlo(namedtuple('MonteCarlo', 'calc rounds batch seed')):
+	"""Estimate OddsCalculator.calculateOdds by dealing rounds at random.
+
+	Rounds are played in numpy batches using lookup tables built from the
+	calculator's rule (its houseHits and pay) over every Hand, and cards are
+	drawn from its initCards via CardState.urn. Each action is estimated the
+	same way calc defines it: S stands, and H hits once then stands (approx2h:
+	then, for the hands that can still hit, hits once more if that is better
+	on average over those hands; exact: then follows optimal hit/stand play).
+	In exact mode D hits once then stands with a doubled bet; P, U, and D in
+	other modes are derived from the other estimates as in calculateOdds.
+
+	Exact mode only supports NullCardState, since the optimal play of a card
+	state that changes as cards are drawn depends on the cards drawn.
+
+	This is much cheaper than enumerating a deep TotalCardState, and gives a
+	statistical check of approximations such as PROB_EVENT_TOLERANCE.
+	"""
+
+	def __new__(cls, calc, rounds=1000000, batch=100000, seed=None):
+		if numpy is None: raise ImportError("MonteCarlo requires numpy")
+		if calc.exact and calc.initCards.__class__ is not NullCardState:
+			raise ValueError("MonteCarlo only supports exact mode for NullCardState")
+		self = super(MonteCarlo, cls).__new__(cls, calc, rounds, batch, seed)
+		rule = calc.rule
+		hands = Hand.all()
+		self._add = numpy.array([[0]*10] + [map(int, (h.add(i) for i in xrange(10))) for h in hands[1:]])
+		self._canHit = numpy.array([False] + [h.canHit() for h in hands[1:]])
+		self._houseHits = numpy.array([False] + [rule.houseHits(h) for h in hands[1:]])
+		pay = payTable(rule).pay
+		self._pay = numpy.array([[0.0]*len(hands)] + [[0.0] + [float(pay(h, p)) for p in hands[1:]] for h in hands[1:]])
+		self._cells = {}
+		return self
+
+	def _basicStrategy(self, h0):
+		"""Whether to hit each hand, playing optimally against h0 with calc's NullCardState."""
+		rule, cards = self.calc.rule, self.calc.initCards
+		hit = lambda p: p.canHit() and p.isDealComplete() and optimalValue(rule, p, cards, h0) > standValue(rule, p, cards, h0)
+		return numpy.array([False] + [hit(p) for p in Hand.all()[1:]])
+
+	def _hit(self, shoe, p, mask=None):
+		mask = self._canHit[p] if mask is None else mask & self._canHit[p]
+		return numpy.where(mask, self._add[p, shoe.draw(mask=mask)], p)
+
+	def _stand(self, shoe, p, h):
+		"""Play out the house, drawing its hole card first, and pay p."""
+		mask = self._houseHits[h]
+		while mask.any():
+			h = numpy.where(mask, self._add[h, shoe.draw(mask=mask)], h)
+			mask = self._houseHits[h]
+		return self._pay[h, p]
+
+	def _deal(self, cell, n, rng):
+		playerCard0, houseCard, playerCard1 = cell
+		shoe = Shoe(self.calc.initCards, n, rng)
+		empty = numpy.repeat(int(Hand()), n)
+		p = self._add[empty, shoe.draw(playerCard0)]
+		h = self._add[empty, shoe.draw(houseCard)]
+		p = self._add[p, shoe.draw(playerCard1)]
+		return shoe, p, h
+
+	def _simulateBatch(self, cell, n, rng, actions, policy):
+		calc = self.calc
+		pays = {}
+		if "S" in actions:
+			shoe, p, h = self._deal(cell, n, rng)
+			pays["S"] = self._stand(shoe, p, h)
+		if "H" in actions:
+			shoe, p, h = self._deal(cell, n, rng)
+			p = self._hit(shoe, p)
+			if calc.exact:
+				mask = policy[p]
+				while mask.any():
+					p = self._hit(shoe, p, mask)
+					mask = policy[p]
+				pays["H"] = self._stand(shoe, p, h)
+			elif calc.approx2h:
+				again = shoe.copy()
+				pays["H"] = self._stand(shoe, p, h)
+				# hands that can't hit again stand either way
+				pays["HH"] = numpy.where(self._canHit[p], self._stand(again, self._hit(again, p), h), pays["H"])
+			else:
+				pays["H"] = self._stand(shoe, p, h)
+		if "D" in actions and calc.exact:
+			shoe, p, h = self._deal(cell, n, rng)
+			pays["D"] = 2 * self._stand(shoe, self._hit(shoe, p), h)
+		return pays
+
+	def simulateOdds(self, playerCard0, houseCard, playerCard1=None):
+		"""Like OddsCalculator.calculateOdds, but with Estimates of each value."""
+		cell = (playerCard0, houseCard, playerCard1)
+		if cell in self._cells:
+			return self._cells[cell]
+		rule = self.calc.rule
+		p0 = Hand().add(playerCard0).add(playerCard1)
+		h0 = houseHand(houseCard)
+
+		actions = [a for a in "SHD" if a in rule.actions]
+		if not p0.canHit() or "H" not in actions:
+			actions = [a for a in actions if a not in "HD"]
+		policy = self._basicStrategy(h0) if self.calc.exact and "H" in actions else None
+		rng = numpy.random.RandomState(self.seed)
+		tallies = {}
+		left = self.rounds
+		while left > 0:
+			n = min(left, self.batch)
+			for a, pays in self._simulateBatch(cell, n, rng, actions, policy).iteritems():
+				tallies.setdefault(a, _Tally()).add(pays)
+			left -= n
+
+		odds = dict((a, t.estimate()) for a, t in tallies.iteritems())
+		if "HH" in odds:
+			# see the approx2h calculation in calculateOdds: the hands that
+			# can't hit again pay the same in both, so this picks the better
+			# of standing and hitting again for the ones that can
+			odds["H"] = max(odds["H"], odds.pop("HH"), key=lambda e: e.mean)
+		if "D" in actions and not self.calc.exact:
+			# calculateOdds only does this exactly in exact mode
+			odds["D"] = odds["H"].scale(2)
+		if "U" in rule.actions:
+			odds["U"] = Estimate(-0.5, 0.0, 0)
+		if "P" in rule.actions and playerCard0 == playerCard1:
+			odds["P"] = self.simulateOdds(playerCard0, houseCard)[0][1].scale(2)
+
+		odds = sorted(odds.items(), key=lambda p: p[1].mean, reverse=True)
+		self._cells[cell] = odds
+		return odds
+
+	def crossCheck(self, playerCard0, houseCard, playerCard1=None):
+		"""Compare calc.calculateOdds against simulateOdds.
+
+		@return: list of CrossCheck, in the order of calculateOdds
+		"""
+		estimates = dict(self.simulateOdds(playerCard0, houseCard, playerCard1))
+		return [CrossCheck(a, v, estimates[a]) for a, v in self.calc.calculateOdds(playerCard0, houseCard, playerCard1)]
@@ -0,0 +1,155 @@
+import functools
+import json
+import sys
+import time
+
+from collections import Counter
+
+from bj.cache import LRUCache
+
+"""Stats being collected, or None if we aren't collecting any.
+
+Set this (e.g. via --stats) before doing the work to be measured.
+"""
+STATS = None
+
+def add_module_opts(argparser):
+	argparser.add_argument(
+		"--stats", help="Print counts of ProbDist constructions and binds, "
+		"sizes of distributions, probability mass pruned by "
+		"--prob-event-tolerance, time spent in each phase and cache hit rates "
+		"to stderr when done. With --jobs, only work done in the main process "
+		"is counted. Default: %(default)s",
+		default=False, action="store_true")
+	argparser.add_argument(
+		"--stats-json", help="Write the same stats as --stats to this file, "
+		"as JSON.",
+		default=None)
+	old_parse = argparser.parse_args
+	def parse_args(*args, **kwargs):
+		global STATS
+		args = old_parse(*args, **kwargs)
+		STATS = Stats() if args.stats or args.stats_json else None
+		return args
+	argparser.parse_args = parse_args
+
+def sizeBucket(n):
+	"""Histogram bucket of a distribution size, as its lower bound: 0, 1, 2,
+	4, 8, ..."""
+	return 1 << (n.bit_length() - 1) if n else 0
+
+class Timer(object):
+	def __init__(self, stats, name):
+		self.stats = stats
+		self.name = name
+
+	def __enter__(self):
+		self.stats.active[self.name] += 1
+		self.start = time.time()
+
+	def __exit__(self, *exc_info):
+		stats = self.stats
+		stats.calls[self.name] += 1
+		stats.active[self.name] -= 1
+		# only count the outermost of recursive calls
+		if not stats.active[self.name]:
+			stats.seconds[self.name] += time.time() - self.start
+
+class _NullTimer(object):
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc_info):
+		pass
+
+_nullTimer = _NullTimer()
+
+def timer(name):
+	"""Time the enclosed block as the phase name, if we are collecting stats.
+
+	Times are inclusive: a phase nested in another one is counted in both,
+	but a phase nested in itself is only counted once.
+	"""
+	return _nullTimer if STATS is None else Timer(STATS, name)
+
+def timed(name):
+	"""Decorator to time every call of a function as the phase name."""
+	def decorate(f):
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			with timer(name):
+				return f(*args, **kwargs)
+		return wrapper
+	return decorate
+
+class Stats(object):
+	"""Counters for the instrumentation in ProbDist and the calculator."""
+
+	def __init__(self):
+		self.constructed = Counter()
+		self.sizes = Counter()
+		self.binds = 0
+		self.prunedEvents = 0
+		self.prunedMass = 0.0
+		self.calls = Counter()
+		self.seconds = Counter()
+		self.active = Counter()
+		# only count cache lookups from now on, not e.g. import-time self-tests
+		self.cacheBase = dict((c, (c.hits, c.misses)) for c in LRUCache.instances)
+
+	def timer(self, name):
+		return Timer(self, name)
+
+	def distCreated(self, cls, size):
+		self.constructed[cls.__name__] += 1
+		self.sizes[sizeBucket(size)] += 1
+
+	def distBound(self, pruned):
+		"""
+		@param pruned: probabilities of the events that bind skipped
+		"""
+		self.binds += 1
+		if pruned:
+			self.prunedEvents += len(pruned)
+			self.prunedMass += float(sum(pruned))
+
+	def cacheLookups(self, cache):
+		"""
+		@return: (hits, misses) of cache since we started collecting
+		"""
+		hits, misses = self.cacheBase.get(cache, (0, 0))
+		return cache.hits - hits, cache.misses - misses
+
+	def toDict(self):
+		return {
+			"constructed": dict(self.constructed),
+			"binds": self.binds,
+			"sizes": dict((str(k), v) for k, v in self.sizes.iteritems()),
+			"pruned": {"events": self.prunedEvents, "mass": self.prunedMass},
+			"phases": dict((k, {"calls": self.calls[k], "seconds": self.seconds[k]}) for k in self.calls),
+			"caches": dict((c.name, dict(zip(("entries", "hits", "misses"), (len(c),) + self.cacheLookups(c))))
+				for c in LRUCache.instances),
+		}
+
+	def printTable(self, fp=sys.stderr):
+		print >>fp, "-------- ProbDist"
+		for name, n in sorted(self.constructed.items()):
+			print >>fp, "%-32s %12d constructed" % (name, n)
+		print >>fp, "%-32s %12d" % ("binds", self.binds)
+		print >>fp, "%-32s %12d events, %.3g probability summed over binds" % ("pruned by tolerance", self.prunedEvents, self.prunedMass)
+		print >>fp, "-------- len(dist)"
+		for k, n in sorted(self.sizes.items()):
+			print >>fp, "%-32s %12d" % ("%d-%d" % (k, max(k, 2 * k - 1)), n)
+		print >>fp, "-------- phases (inclusive)"
+		for k in sorted(self.calls):
+			print >>fp, "%-32s %12d calls %10.3fs" % (k, self.calls[k], self.seconds[k])
+		print >>fp, "-------- caches"
+		for c in LRUCache.instances:
+			hits, misses = self.cacheLookups(c)
+			total = hits + misses
+			print >>fp, "%-32s %12d entries %6.1f%% hits of %d" % (c.name, len(c), 100.0 * hits / total if total else 0, total)
+
+	def dump(self, fp):
+		json.dump(self.toDict(), fp, indent=1, sort_keys=True)
+
+assert [sizeBucket(n) for n in (0, 1, 2, 3, 4, 7, 8)] == [0, 1, 2, 2, 4, 4, 8]
@@ -0,0 +1,80 @@
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import tempfile
+
+from collections import namedtuple
+
+import bj.prob
+
+def defaultPath():
+	return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "bjsim")
+
+def codeVersion():
+	"""Hash of the source of this package, so that results from older code are
+	never served."""
+	h = hashlib.sha1()
+	d = os.path.dirname(os.path.abspath(__file__))
+	for name in sorted(os.listdir(d)):
+		if name.endswith(".py"):
+			with open(os.path.join(d, name), "rb") as fp:
+				h.update(name)
+				h.update(fp.read())
+	return h.hexdigest()
+
+CODE_VERSION = codeVersion()
+
+class OddsStore(namedtuple('OddsStore', 'path')):
+	"""Persistent store of OddsCalculator.calculateOdds results.
+
+	Results are kept one file per cell, in a directory per set of parameters
+	that can affect them: the code version, the calculator's rule, card state
+	and options, and PROB_EVENT_TOLERANCE. PROB_SPACE_TOLERANCE is
+	only a sanity check, and never changes a result. Files are written to a temporary
+	name and then renamed into place, so any number of processes can share the
+	same store safely.
+	"""
+
+	def params(self, calc):
+		return (CODE_VERSION, repr(calc.rule), repr(calc.initCards), calc.approx2h,
+			calc.exact, calc.splitHands, bj.prob.PROB_EVENT_TOLERANCE)
+
+	def dirFor(self, calc):
+		params = repr(self.params(calc))
+		d = os.path.join(self.path, hashlib.sha1(params).hexdigest()[:16])
+		if not os.path.isdir(d):
+			try:
+				os.makedirs(d)
+			except OSError, e:
+				if e.errno != errno.EEXIST: raise
+			self._write(os.path.join(d, "params"), params + "\n")
+		return d
+
+	def _cellPath(self, calc, cell):
+		return os.path.join(self.dirFor(calc), "%s%s%s.pickle" % tuple("x" if c is None else c for c in cell))
+
+	def _write(self, path, data):
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as fp:
+				fp.write(data)
+			os.rename(tmp, path)
+		except:
+			os.unlink(tmp)
+			raise
+
+	def get(self, calc, cell):
+		"""
+		@param cell: (playerCard0, houseCard, playerCard1)
+		@return: the stored odds, or None if there are none.
+		"""
+		try:
+			with open(self._cellPath(calc, cell), "rb") as fp:
+				return pickle.load(fp)
+		except IOError, e:
+			if e.errno != errno.ENOENT: raise
+			return None
+
+	def put(self, calc, cell, odds):
+		self._write(self._cellPath(calc, cell), pickle.dumps(odds, pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,135 @@
+import time
+
+from collections import namedtuple
+
+from bj.bankroll import kellyFraction, payMean, payVariance
+from bj.cache import trimCaches
+from bj.odds import HOUSE_CARDS, dealProbability, sortOdds
+from bj.prob import ProbDist, exact
+
+"""Every 2-card player hand, as (playerCard0, playerCard1) with the lower card
+first."""
+HANDS = [(a, b) for a in xrange(10) for b in xrange(a, 10)]
+
+class SweepPoint(namedtuple('SweepPoint', 'seen card cards ev odds seconds variance kelly approximate')):
+	"""Results for one point of a sweep.
+
+	Attributes:
+		seen: Number of cards removed from the initial card state so far.
+		card: The last card removed, or None at the start.
+		cards: The card state after removing them.
+		ev: Expected pay of a round played with the best action in each cell.
+		odds: calculateOdds results for each of the cells asked for.
+		seconds: Time taken to calculate this point.
+		variance: Variance of the pay of that round, with calc.payoffs,
+		    otherwise None.
+		kelly: Kelly fraction of the bankroll to bet on that round (see
+		    bj.bankroll), with calc.payoffs, otherwise None.
+		approximate: With calc.payoffs, whether the variance and kelly are
+		    only approximate, because some cell is split without
+		    calc.splitHands (see calculatePayoffs), otherwise None.
+	"""
+
+	def __new__(cls, seen, card, cards, ev, odds, seconds, variance=None, kelly=None, approximate=None):
+		return super(SweepPoint, cls).__new__(cls, seen, card, cards, ev, odds, seconds, variance, kelly, approximate)
+
+def roundOdds(calc, houseCards=HOUSE_CARDS, hands=HANDS):
+	"""Expected pay of a round dealt from calc.initCards, with the player
+	taking the best action for each initial hand.
+
+	Each cell is weighted by the probability of dealing it in either order,
+	since dealing the same cards in another order leaves the same hand and
+	card state.
+	"""
+	ev = 0
+	for houseCard in houseCards:
+		splits = {}
+		for playerCard0, playerCard1, p in _roundCells(calc, houseCard, hands):
+			ev += p * calc.calculateOdds(playerCard0, houseCard, playerCard1, splits)[0][1]
+	return ev
+
+def roundPayoffs(calc, houseCards=HOUSE_CARDS, hands=HANDS, actions=None):
+	"""Distribution of the pay of a round, played as in roundOdds. Its
+	expectation is roundOdds, and the best actions are taken from the
+	payoffs (see OddsCalculator.payoffOdds), so nothing is played out twice.
+
+	@param actions: list that the best action for each cell is appended to,
+	    e.g. to tell whether any of their payoffs were approximate
+	@return: ProbDist([(pay, p)])
+	"""
+	payoffs = []
+	for houseCard in houseCards:
+		splits = {}
+		for playerCard0, playerCard1, p in _roundCells(calc, houseCard, hands):
+			cell = calc.calculatePayoffs(playerCard0, houseCard, playerCard1, splits)
+			action = sortOdds(calc.payoffOdds(cell))[0][0]
+			payoffs.append((cell[action], p))
+			if actions is not None:
+				actions.append(action)
+	return ProbDist([(n, p) for n, (d, p) in enumerate(payoffs)]).bind(lambda n: payoffs[n][0])
+
+def _roundCells(calc, houseCard, hands):
+	"""
+	@return: iterator of (playerCard0, playerCard1, p) for each of hands that
+	    can be dealt against houseCard
+	"""
+	for playerCard0, playerCard1 in hands:
+		p = dealProbability(calc.initCards, [playerCard0, houseCard, playerCard1])
+		if playerCard0 != playerCard1:
+			p += dealProbability(calc.initCards, [playerCard1, houseCard, playerCard0])
+		if p:
+			yield playerCard0, playerCard1, exact(p)
+
+def sweep(calc, shoe, cells=(), every=1):
+	"""Calculate the round EV, and odds for each of cells, at each point of a
+	shoe as it is dealt.
+
+	The card state for each point is the previous one with a card removed
+	(see CardState.remove), and each point is calculated with calc with just
+	its initCards replaced. The house plays from its up card and the cards
+	left in every mode (see dealPlayer), and houseOutcomes (and in exact mode
+	optimalValue) are cached by card state, so a point reuses the house trees
+	of the points before it that drew the same cards, as long as they are
+	still in the caches (see --cache-size). That makes the later points of a
+	sweep cheaper than the first, but each one still deals and plays out
+	every cell. The caches are trimmed between points (see trimCaches), so a
+	long sweep stays within --cache-size. Points are yielded as soon as they
+	are calculated, so the caller can stream them out.
+
+	@param shoe: the cards dealt, in order
+	@param cells: list of (playerCard0, houseCard, playerCard1)
+	@param every: only calculate every this many cards, and after the last one
+	@return: iterator of SweepPoint, starting with calc.initCards itself. With
+	    calc.payoffs, the ev of each comes from roundPayoffs, along with the
+	    variance and Kelly fraction of the round.
+	"""
+	cards = calc.initCards
+	card = None
+	last = None
+	for seen in xrange(len(shoe) + 1):
+		if seen:
+			card = shoe[seen - 1]
+			try:
+				cards = cards.remove(card)
+			except ValueError:
+				raise ValueError("card %s at position %d of the shoe is not left in %s" % (card, seen, cards))
+		if seen % every and seen != len(shoe):
+			continue
+		start = time.time()
+		# e.g. NullCardState isn't changed by removing cards
+		if last is None or last.cards != cards:
+			pointCalc = calc._replace(initCards=cards)
+			odds = [pointCalc.calculateOdds(*cell) for cell in cells]
+			if calc.payoffs:
+				actions = []
+				payoffs = roundPayoffs(pointCalc, actions=actions)
+				last = SweepPoint(seen, card, cards, payMean(payoffs), odds, None,
+					payVariance(payoffs), kellyFraction(payoffs), "P" in actions and not calc.splitHands)
+			else:
+				last = SweepPoint(seen, card, cards, roundOdds(pointCalc), odds, None)
+			trimCaches()
+		yield last._replace(seen=seen, card=card, seconds=time.time() - start)
+
+
+from bj.card import NullCardState
+assert sum(dealProbability(NullCardState(), [a, u, b]) * (1 if a == b else 2) for u in HOUSE_CARDS for a, b in HANDS) == 1
@@ -0,0 +1,50 @@
+import unittest
+
+from bj.seats import seatOdds
+from bj.card import HiLoCardState, NullCardState
+from bj.hand import Hand
+from bj.house import houseOutcome, houseOutcomes, payTable
+from bj.odds import optimalValue, standValue
+from bj.prob import ProbDist, exact
+from bj.rule import BJ
+
+
+def jointSeatOdds(rule, initCards, numSeats, houseCard):
+	"""seatOdds the slow way: every seat's hand is kept along with the cards
+	until the end of the round, and the house plays once, from the cards
+	that all of them left, against every seat."""
+	def deal((h, hands, cards)):
+		return cards.draw().bind(lambda (card0, cards0): cards0.draw().bind(lambda (card1, cards1):
+			play(h, hands, Hand().add(card0).add(card1), cards1)))
+	def play(h, hands, p, cards):
+		if not p.canHit() or optimalValue(rule, p, cards, h) <= standValue(rule, p, cards, h):
+			# finished hands only need to pay the same, see houseOutcome
+			return ProbDist.inject((h, hands + (houseOutcome(p),), cards))
+		return cards.draw().bind(lambda (card, nextcards): play(h, hands, p.add(card), nextcards))
+	rounds = initCards.draw(houseCard).map(lambda (card, cards): (Hand().add(card), (), cards))
+	for i in xrange(numSeats):
+		rounds = rounds.bind(deal)
+	pay = payTable(rule).pay
+	# seatOdds indexes the seats from the last one to play
+	return [0] + [rounds.expect(lambda (h, hands, cards):
+		houseOutcomes(rule, h, cards).expect(lambda o: pay(o, hands[-i]))) for i in xrange(1, numSeats + 1)]
+
+
+class SeatOddsTest(unittest.TestCase):
+	def test_null_card_state_seats_are_alike(self):
+		# with no card counting, what the seats before leave behind makes no
+		# difference
+		odds = seatOdds(BJ, NullCardState(), 3, 6)
+		self.assertEqual(odds[0], 0)
+		self.assertEqual(len(set(odds[1:])), 1)
+
+	def test_counting_seats_match_joint_round(self):
+		odds = seatOdds(BJ, HiLoCardState(1), 2, 6)
+		joint = jointSeatOdds(BJ, HiLoCardState(1), 2, 6)
+		self.assertEqual([exact(x) for x in odds], [exact(x) for x in joint])
+		# the second seat to play does see the cards the first one took
+		self.assertNotEqual(odds[1], odds[2])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import bj.house
+from bj.cache import clearCaches
+from bj.card import HiLoCardState
+from bj.hand import Hand
+from bj.house import houseHand, standPay
+from bj.odds import optimalValue, splitHand, splitValue
+from bj.prob import exact
+from bj.rule import BJ
+
+
+def fullSplitValue(rule, c, h, cards, maxHands, p=None, pending=2, hands=2, memo=None):
+	"""splitValue the slow way: no pruning, and memoised on every argument,
+	so no values are shared between hands."""
+	if memo is None:
+		memo = {}
+	if p is not None and not pending:
+		return optimalValue(rule, p, cards, h)
+	key = (cards, p, pending, hands)
+	if key in memo:
+		return memo[key]
+	value = lambda cards, p, pending, hands: fullSplitValue(rule, c, h, cards, maxHands, p, pending, hands, memo)
+	if p is not None:
+		pay = standPay(rule, p, h, cards) + value(cards, None, pending, hands)
+		if p.canHit():
+			pay = max(pay, cards.draw().expect(lambda (card, nextcards): value(nextcards, p.add(card), pending, hands)))
+	elif not pending:
+		pay = 0
+	else:
+		def deal((card, nextcards)):
+			q = splitHand(c, card)
+			if c == 1:
+				pay = standPay(rule, q, h, nextcards) + value(nextcards, None, pending - 1, hands)
+			else:
+				pay = value(nextcards, q, pending - 1, hands)
+			if card == c and hands < maxHands:
+				pay = max(pay, value(nextcards, None, pending + 1, hands + 1))
+			return pay
+		pay = cards.draw().expect(deal)
+	memo[key] = pay
+	return pay
+
+
+def housePlays(f):
+	"""Number of house trees f plays out from scratch."""
+	clearCaches()
+	misses = bj.house._outcomes.misses
+	f()
+	return bj.house._outcomes.misses - misses
+
+
+class SplitValueTest(unittest.TestCase):
+	h = houseHand(6)
+
+	def cards(self, c):
+		return HiLoCardState(1).remove(c).remove(c).remove(6)
+
+	def test_pruned_split_matches_full(self):
+		for c, maxHands in ((0, 2), (1, 3), (8, 2)):
+			self.assertEqual(exact(splitValue(BJ, c, self.h, self.cards(c), maxHands)),
+				exact(fullSplitValue(BJ, c, self.h, self.cards(c), maxHands)))
+
+	def test_split_house_plays(self):
+		# regression check on how much house play a split takes. The second
+		# hand starts from every card state the first can leave, so this is
+		# more like the square of playing one hand than a multiple of it: 60
+		# times as much here.
+		cards = self.cards(8)
+		one = housePlays(lambda: optimalValue(BJ, Hand().add(8).add(8), cards, self.h))
+		split = housePlays(lambda: splitValue(BJ, 8, self.h, cards, 2))
+		full = housePlays(lambda: fullSplitValue(BJ, 8, self.h, cards, 2))
+		self.assertLess(split, full)
+		self.assertLess(split, 70 * one)
+
+
+if __name__ == "__main__":
+	unittest.main()